@@ -1,181 +1,377 @@
 #!/usr/bin/env python
 # coding: utf-8
 
-import structlog
-import requests
-from pymongo.errors import DuplicateKeyError, BulkWriteError
+from pymongo.errors import BulkWriteError
 from MongoDB.client import DevDB
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
 
-from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
-from pytz import timezone
-from latest_user_agents import get_latest_user_agents
+from functools import partial
+from SEC_db import ensure_index, BatchWriter, Journal, CIKS
+from SEC_fetcher import get_html, get_html_content, get_accession, content_ok, page_ok, FetchError, FETCH_MODE, POOL
+from SEC_index import read_index, get_index_link, FORMS_13F
+from SEC_metrics import configure_logging, log, METRICS
+from SEC_pipeline import Stage, run_pipeline
+from SEC_tables import get_filing_history, get_filing_info, get_info_table_link, get_info_table_rows, get_listing_rows
 
+import itertools
 import sys
+import time
 
 URL = 'https://www.sec.gov/cgi-bin/browse-edgar?company=&CIK=&type=13F&owner=include&count=100&action=getcurrent'
 PREFIX = 'https://www.sec.gov'
-log_file = open('log.sec_13f', 'a', encoding='utf-8')
-logger = structlog.PrintLogger(log_file)
-
-
-def user_agent():
-    # get latest user agents
-    user_agents = get_latest_user_agents()
-    user_agent = ''
-    for i in user_agents:
-        if sys.platform == 'darwin' and ('Macintosh' in i):
-            user_agent = i
-        if sys.platform == 'linux' and ('Linux' in i) and ('Android' not in i):
-            user_agent = i
-    if not user_agent:
-        user_agent = user_agents[4]
-    return user_agent
-
-
-USER_AGENT = user_agent()
-
-
-def get_soup(url):
-    chrome_options = Options()
-    chrome_options.add_argument("--headless")
-    chrome_options.add_argument("start-maximized")
-    chrome_options.add_argument("disable-infobars")
-    chrome_options.add_argument("--disable-extensions")
-    chrome_options.add_argument("--window-size=1920x1080")
-    chrome_options.add_argument("--disable-dev-shm-usage")
-    chrome_options.add_argument("--no-sandbox")
-    chrome_options.add_argument("--user-agent=%s" % USER_AGENT)
-    service = Service('/usr/bin/chromedriver')
-    driver = webdriver.Chrome(options=chrome_options, service=service)
-    driver.get(url)
-    soup = BeautifulSoup(driver.page_source, 'html.parser')
-    driver.quit()
-    return soup
+INDEX_CHECK = 'Document Format Files' # present on every filing index page
+TABLE_CHECK = 'Form 13F-NT Header Information' # present on every rendered information table
+MAX_AGE_DAYS = 5
+HISTORY_LIMIT = 8 # recent 13F filings kept per institution
+WORKERS = 4 # institutions in flight
+FILING_WORKERS = 8 # 13F filings fetched at once across all institutions; the rate limiter caps requests
+CHUNK_SIZE = 1000 # holdings handed to the writer at once, so a filing is never held in memory whole
+JOURNAL = Journal('13F') # filings of the scheduled runs, see SEC_db.Journal
+BACKFILL_JOURNAL = Journal('13FBackfill') # index filings of the backfills
+WRITER_13F = BatchWriter('MA_SEC_13F', [('CIK', 1), ('FiledDate', 1), ('CUSIP', 1),
+                                        ('Class', 1), ('Amount', 1), ('AMTType', 1)])
+REPORT = 'report.sec_13f.json' # end-of-run metrics, see SEC_metrics.py
+BACKFILL_REPORT = 'report.sec_13f_backfill.json'
+LOG_FILE = 'log.sec_13f' # log of the runs started from the command line
+LISTING_TRIES = 3 # passes over a listing filing not found stored, e.g. while a cached filing history lacks it
 
 
 def load_ciks():
-    # load the cik dictionary from MongoDB
-    cik_list = list(DevDB.find('MA_SEC_CIKList', {'Type': 'Issuer'}))
-    result = dict()
-    for cik in cik_list:
-        result[cik['CIK']] = cik['Symbol']
-    return result
+    # load the cik dictionary from MongoDB; symbols resolved later in the run are added to it
+    return CIKS.load()
 
 
-def get_single_13F(link, date):
-    # get single 13F filing list
-    soup = get_soup(PREFIX + link)
-    new_link = ''
-    for row in soup.findAll(text='INFORMATION TABLE'):
-        item = row.parent.previous_sibling.previous_sibling
-        if item.text[-4:] == 'html':
-            new_link = item.a['href']
-            break
+def to_number(text, cast=int):
+    # a number column of an information table, 0 when blank
+    text = text.replace(',', '').strip()
+    return cast(text) if text else 0
+
+
+def get_13F_chunks(link, date, chunk_size=CHUNK_SIZE):
+    # yield the holdings of a single 13F filing in lists of up to chunk_size records; FetchError if the
+    # filing index or the information table is missing or blocked, so the filing is not taken as stored
+    page = get_html(PREFIX + link, INDEX_CHECK)
+    if not page_ok(page, INDEX_CHECK):
+        raise FetchError('cannot fetch 13F filing index ' + link)
+    with METRICS.timer('parse.index'):
+        new_link = get_info_table_link(page)
+        form_type, period = get_filing_info(page)
     if not new_link:
-        return list()
-    data = get_soup(PREFIX + new_link)
-    table = data.find('table', attrs={'summary':'Form 13F-NT Header Information'})
-    if table == None:
-        return list()
-    result = list()
+        return
+    content = get_html_content(PREFIX + new_link, TABLE_CHECK)
+    if not content_ok(content, TABLE_CHECK):
+        raise FetchError('cannot fetch 13F information table ' + new_link)
     cik = int(new_link.split('/')[4])
-    for row in table.tbody.findAll('tr'):
-        if not row.findAll('td', attrs={'class': 'FormData'}):
+    update_time = datetime.now()
+    chunk = list()
+    parse = 0 # seconds spent parsing, excluding the time the consumer holds each chunk
+    start = time.perf_counter()
+    for cols in get_info_table_rows(content):
+        if len(cols) < 12:
             continue
-        cols = row.findAll('td')
-        name = cols[0].text
-        class_title = cols[1].text
-        cusip = cols[2].text
-        value = float(cols[3].text.replace(',', '')) * 1000
-        amount = int(cols[4].text.replace(',', ''))
-        amt_type = cols[5].text
-        if cols[6].text != '\xa0':
-            amt_type += ' ' + cols[6].text
-        investment_discretion = cols[7].text
-        other = '' if cols[8].text == '\xa0' else cols[8].text
-        voting_sole = int(cols[9].text.replace(',', '')) if cols[9].text == '\xa0' else 0
-        voting_shared = int(cols[10].text.replace(',', '')) if cols[10].text == '\xa0' else 0
-        voting_none = int(cols[11].text.replace(',', '')) if cols[11].text == '\xa0' else 0
+        name = cols[0]
+        class_title = cols[1]
+        cusip = cols[2]
+        value = to_number(cols[3], float) * 1000
+        amount = to_number(cols[4])
+        amt_type = cols[5]
+        if cols[6].strip():
+            amt_type += ' ' + cols[6]
+        investment_discretion = cols[7]
+        other = cols[8] if cols[8].strip() else ''
+        voting_sole = to_number(cols[9])
+        voting_shared = to_number(cols[10])
+        voting_none = to_number(cols[11])
         record = {'CIK': cik, 'FiledDate': date, 'CUSIP': cusip, 'Name': name, 'Class': class_title,
                  'Value': value, 'Amount': amount, 'AMTType': amt_type, 'InvestmentDiscretion': investment_discretion,
                  'Other': other, 'VotingSole': voting_sole, 'VotingShared': voting_shared, 'VotingNone': voting_none,
-                 'FormURL': new_link, 'UpdateTime': datetime.now(), 
+                 'FormURL': new_link, 'FormType': form_type, 'Period': period, 'UpdateTime': update_time,
                   '_id': {'CIK': cik, 'FiledDate': date, 'CUSIP': cusip, 'Class': class_title,
                           'Amount': amount, 'AMTType': amt_type}}
-        result.append(record)
-    return result
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            parse += time.perf_counter() - start
+            yield chunk
+            chunk = list()
+            start = time.perf_counter()
+    METRICS.record('parse.13F', parse + time.perf_counter() - start)
+    if chunk:
+        yield chunk
 
 
-def upload_13F(data):
-    # upload institution transaction results to database collection named MA_SEC_13F
-    DevDB.create_index('MA_SEC_13F', [('CIK', 1), ('FiledDate', 1), ('CUSIP', 1), 
-                                        ('Class', 1), ('Amount', 1), ('AMTType', 1)])
-    if data:
-        now = datetime.now(timezone('US/Eastern'))
-        dt_string = now.strftime("%y/%m/%d %H:%M:%S %Z%z")
-        try:
-            result = DevDB.insert_many('MA_SEC_13F', data, ordered=False)
-            # logger.info('Inserted: %d' % (len(result.inserted_ids)))
-            print('Inserted: %d' % (len(result.inserted_ids)))
-        except BulkWriteError as e:
-            # logger.info('Partial inserted: %d' % (len(data)-len(e.details['writeErrors'])))
-            print('Partial inserted: %d' % (len(data)-len(e.details['writeErrors'])))
+def upload_13F(data, callback=None):
+    # upload institution transaction results to database collection named MA_SEC_13F, in batches;
+    # callback runs once the results are stored
+    if data or callback is not None:
+        WRITER_13F.add(data, callback)
     return
 
 
-def update_cik(data):
-    # update institution CIK to MA_SEC_CIKList
-    str_list = data.previous_sibling.previous_sibling.text.split('(')
+def update_cik(filer):
+    # update the institution CIK of a listing row heading, e.g. 'NAME (0001234567) (Filer)', to MA_SEC_CIKList
+    str_list = filer.split('(')
     name = str_list[0][:-1].replace('\n', '')
     cik = int(str_list[1].split(')')[0])
-    # Add new issuer cik info to database
-    DevDB.create_index('MA_SEC_CIKList', [('CIK', 1), ('Type', 1)])
+    return update_cik_institution(cik, name)
+
+
+def update_cik_institution(cik, name):
+    # Add new institution cik info to the registry, written to database in batches
+    return CIKS.update(cik, name, 'Institution')
+
+
+def get_filing_list(link, limit=4):
+    # get the document links and filed dates of the recent limit number of 13F filings of an institution
+    page = get_html(PREFIX + link)
+    with METRICS.timer('parse.history'):
+        return get_filing_history(page, limit)
+
+
+def ingest_13F(link, date, journal=None):
+    # stream the holdings of a single 13F filing to the writer chunk by chunk, isolating a failed filing
+    # from the rest of the history; returns the number of holdings, None on error. With a journal the
+    # filing is journaled as written once stored, or as failed for a later retry
+    key = get_filing_key(link)
+    failed = WRITER_13F.counts['Failed']
+    rows = 0
     try:
-        record = {'CIK': cik, 'CompanyName': name, 'Type': 'Institution', 
-                  'UpdateTime': datetime.now(), '_id': {'CIK': cik, 'Type': 'Institution'}}
-        DevDB.replace_one('MA_SEC_CIKList', {'_id': record['_id']}, record, upsert=True)
-        status = True
+        for chunk in get_13F_chunks(link, date):
+            upload_13F(chunk)
+            rows += len(chunk)
     except Exception as e:
-        # logger.warning('Insert/Update CIKList error: {}'.format(e))
-        print('Insert/Update CIKList error: {}'.format(e))
-        status = False
-    return status
-
-
-def get_history_13F(link, limit=4):
-    # get recent limit number of 13F filings of a single institution
-    soup = get_soup(PREFIX + link)
-    count = 0
-    result = list()
-    for document in soup.findAll('a', attrs={'id': 'documentsbutton'}):
-        if count > limit - 1:
-            break
-        filed_date = document.parent.next_sibling.next_sibling.next_sibling.next_sibling.text
-        result.extend(get_single_13F(document['href'], filed_date))
-        count += 1
+        METRICS.count('filings_failed')
+        log.warning('13F filing error', link=link, error=str(e))
+        if journal is not None:
+            journal.fail(get_journal_key(key), e)
+        return None
+    upload_13F(list(), partial(mark_written, [key], failed, journal))
+    METRICS.count('filings')
+    METRICS.count('rows', rows)
+    return rows
+
+
+def mark_written(keys, failed, journal=None):
+    # mark filings ingested unless a write failed after their first chunk was queued; the check is
+    # conservative, a failure of any concurrent filing leaves them to be fetched again next run
+    if WRITER_13F.counts['Failed'] != failed:
+        return
+    mark_ingested(keys)
+    if journal is not None:
+        for key in keys:
+            journal.written(get_journal_key(key))
+
+
+def ingest_filings_13F(filings, executor=None, fetched=None, journal=None):
+    # stream the holdings of (link, filed date) 13F filings to the writer, concurrently if an executor
+    # is given; returns the number of holdings, and the filings ingested without error go to fetched
+    if executor is None:
+        results = [ingest_13F(document, filed_date, journal) for document, filed_date in filings]
+    else:
+        futures = [executor.submit(ingest_13F, document, filed_date, journal) for document, filed_date in filings]
+        results = [future.result() for future in futures]
+    total = 0
+    for (document, _), rows in zip(filings, results):
+        if rows is None:
+            continue
+        total += rows
+        if fetched is not None:
+            fetched.append(document)
+    return total
+
+
+def get_filing_key(link):
+    # (cik, accession) of a 13F filing index or information table link
+    return int(link.split('/')[4]), get_accession(link)
+
+
+def get_journal_key(key):
+    # journal key of a (cik, accession) filing key
+    return '%d:%s' % key
+
+
+def load_ingested():
+    # (cik, accession) pairs of the 13F filings already stored, kept in MA_SEC_13FIndex
+    result = set()
+    for record in DevDB.find('MA_SEC_13FIndex', {}, {'CIK': 1, 'Accession': 1}):
+        result.add((record['CIK'], record['Accession']))
+    if not result:
+        # first run: build the index from the stored holdings, reading only their FormURL index
+        ensure_index('MA_SEC_13F', [('FormURL', 1)])
+        for record in DevDB.find('MA_SEC_13F', {}, {'FormURL': 1, '_id': 0}):
+            result.add(get_filing_key(record['FormURL']))
+        mark_ingested(result)
     return result
 
 
-cik_list = load_ciks()
-soup = get_soup(URL)
-table = soup.findAll('tr', attrs={'nowrap': 'nowrap'})
-if not table:
+def mark_ingested(keys):
+    # add (cik, accession) pairs of stored 13F filings to MA_SEC_13FIndex
+    records = [{'CIK': cik, 'Accession': accession, 'UpdateTime': datetime.now(),
+                '_id': {'CIK': cik, 'Accession': accession}} for cik, accession in keys]
+    if records:
+        try:
+            DevDB.insert_many('MA_SEC_13FIndex', records, ordered=False)
+        except BulkWriteError as e:
+            pass # already indexed
+
+
+def get_recent_filers(listed=None):
+    # get the listing rows, as (filer, cell texts, cell hrefs), of 13F filers of the recent MAX_AGE_DAYS days,
+    # skipping the filings, as (cik, accession), in listed
+    page = get_html(URL)
+    with METRICS.timer('parse.listing'):
+        rows = list(get_listing_rows(page))
+    for row in rows:
+        filer, columns, links = row
+        cik = int(links[1].split('/')[4])
+        filed_date = columns[4]
+        filed_dt = datetime.strptime(filed_date, '%Y-%m-%d')
+        log.debug('13F filer', filed=filed_date, cik=cik)
+        # only scan filings of recent 5 days
+        if datetime.now() - filed_dt > timedelta(days=MAX_AGE_DAYS):
+            break
+        if listed is not None and get_filing_key(links[1]) in listed:
+            continue
+        yield cik, row
+
+
+def process_institution(row, executor=None, ingested=None, journal=None):
+    # update and upload the recent 13F history of the institution in a listing row,
+    # skipping the filings already in ingested, or already journaled, without any fetch
+    ingested = set() if ingested is None else ingested
+    filer, columns, links = row
+    update_cik(filer)
+    filings = get_filing_list(links[-1], HISTORY_LIMIT)
+    new_filings = [filing for filing in filings if get_filing_key(filing[0]) not in ingested]
+    if journal is not None:
+        new_filings = [filing for filing in new_filings
+                       if journal.add(get_journal_key(get_filing_key(filing[0])), list(filing))]
+    fetched = list()
+    rows = ingest_filings_13F(new_filings, executor, fetched, journal)
+    ingested.update(get_filing_key(document) for document in fetched)
+    return {'Rows': rows, 'Fetched': len(fetched), 'Skipped': len(filings) - len(new_filings)}
+
+
+def index_stage(item, ingested, journal):
+    # (journal key, 13F index line) -> number of holdings uploaded, skipping filings already stored
+    _, filing = item
+    link = get_index_link(filing)
+    key = get_filing_key(link)
+    if key in ingested:
+        journal.written(get_journal_key(key))
+        return None
+    update_cik_institution(filing['CIK'], filing['CompanyName'])
+    rows = ingest_13F(link, filing['DateFiled'], journal)
+    if rows is None:
+        return None
+    ingested.add(key)
+    return rows
+
+
+def get_index_key(filing):
+    # journal key of a 13F index line
+    return get_journal_key(get_filing_key(get_index_link(filing)))
+
+
+def backfill(sources, workers=FILING_WORKERS):
+    # rebuild MA_SEC_13F from EDGAR form.idx/master.idx files (local paths, urls, 'YYYYQn' quarters or
+    # 'YYYYMMDD' days); filings journaled by an interrupted backfill are resumed rather than fetched again
+    log_file = open(LOG_FILE, 'a', encoding='utf-8')
+    configure_logging(file=log_file)
+    ingested = load_ingested()
+    journal = BACKFILL_JOURNAL.load()
+    filings = journal.discover(read_index(sources, FORMS_13F), get_index_key)
+    stages = [Stage('13F', partial(index_stage, ingested=ingested, journal=journal), workers)]
+    summaries = run_pipeline(itertools.chain(journal.resumable(), filings), stages)
+    for summary in summaries:
+        log.info('pipeline stage', **summary)
+    CIKS.flush()
+    WRITER_13F.flush()
+    WRITER_13F.report()
+    journal.flush()
+    journal.report()
+    POOL.close()
+    METRICS.write_report(BACKFILL_REPORT, Job='13FBackfill', Sources=list(sources), Pipeline=summaries,
+                         Writer=dict(WRITER_13F.counts), Journal=journal.summary())
+    configure_logging()
     log_file.close()
-    table = list()
-for row in table:
-    columns = row.findAll('td')
-    cik = int(columns[1].a['href'].split('/')[4])
-    filed_date = columns[4].text
-    filed_dt = datetime.strptime(filed_date, '%Y-%m-%d')
-    print(filed_date, cik)
-    # only scan filings of recent 5 days
-    if datetime.now() - filed_dt > timedelta(days=5):
-        break
-    update_cik(row)
-    upload_13F(get_history_13F(columns[-1].a['href'], 8))
-
-log_file.close()
+
+
+def load_state():
+    # warm state of the scheduled runs: the cik registry, the filings already stored, the journal and
+    # the listing filings handled so far; a long-running process keeps it across runs, see SEC_service.py
+    load_ciks()
+    return {'ingested': load_ingested(), 'journal': JOURNAL.load(), 'listed': set(), 'tries': dict()}
+
+
+def run(state, filings, institutions):
+    # one pass with everything stored on return: unfinished filings of earlier passes are resumed first
+    # from the journal, then the recent filers of the listing get their new filings ingested. Listing
+    # filings found stored afterwards, or after LISTING_TRIES passes, are not looked at again; institutions and their filings run on
+    # separate executors, so institution workers waiting on their filings never starve the filing
+    # workers. Returns the sections of the run report
+    ingested = state['ingested']
+    journal = state['journal']
+    failed = list()
+    totals = {'Rows': 0, 'Fetched': 0, 'Skipped': 0}
+    resumed = list()
+    for key, (document, filed_date) in journal.resumable():
+        if get_filing_key(document) in ingested:
+            journal.written(key)
+        else:
+            resumed.append((document, filed_date))
+    fetched = list()
+    totals['Rows'] += ingest_filings_13F(resumed, filings, fetched, journal)
+    totals['Fetched'] += len(fetched)
+    ingested.update(get_filing_key(document) for document in fetched)
+    log.info('resumed journaled filings', count=len(resumed), fetched=len(fetched))
+    futures = {institutions.submit(process_institution, row, filings, ingested, journal): (cik, row)
+               for cik, row in get_recent_filers(state['listed'])}
+    for future in as_completed(futures):
+        cik, (filer, columns, links) = futures[future]
+        try:
+            summary = future.result()
+        except Exception as e:
+            log.error('institution error', cik=cik, error=str(e))
+            failed.append(cik)
+            continue
+        key = get_filing_key(links[1])
+        tries = state['tries'].get(key, 0) + 1
+        if key in ingested or tries >= LISTING_TRIES:
+            state['listed'].add(key)
+            state['tries'].pop(key, None)
+        else:
+            state['tries'][key] = tries
+        for key in totals:
+            totals[key] += summary[key]
+    log.info('institutions', count=len(futures), failed=len(failed), **totals)
+    METRICS.count('institutions', len(futures))
+    CIKS.flush()
+    WRITER_13F.flush()
+    journal.flush()
+    return {'Resumed': len(resumed), 'Institutions': len(futures), 'FailedInstitutions': failed, 'Totals': totals}
+
+
+def main(workers=WORKERS, filing_workers=FILING_WORKERS):
+    # ingest the new 13F filings of the recent filers once, e.g. from cron
+    log_file = open(LOG_FILE, 'a', encoding='utf-8')
+    configure_logging(file=log_file)
+    state = load_state()
+    if FETCH_MODE == 'browser':
+        POOL.warm()
+    with ThreadPoolExecutor(filing_workers) as filings, ThreadPoolExecutor(workers) as institutions:
+        result = run(state, filings, institutions)
+    WRITER_13F.report()
+    state['journal'].report()
+    POOL.close()
+    METRICS.write_report(REPORT, Job='13F', **result, Writer=dict(WRITER_13F.counts),
+                         Journal=state['journal'].summary())
+    configure_logging()
+    log_file.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        backfill(sys.argv[1:])
+    else:
+        main()
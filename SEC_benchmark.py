@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Offline benchmark of the Form 4 and 13F parsers over a fixture corpus (see SEC_replay.py).
+#   python SEC_benchmark.py CORPUS [--repeat N] [--memory]   replay the corpus and report throughput
+#   python SEC_benchmark.py CORPUS --record insider          capture a corpus from a live insider run
+#   python SEC_benchmark.py CORPUS --record 13F              capture a corpus from a live 13F run
+
+import argparse
+import json
+import time
+import tracemalloc
+from urllib.parse import parse_qs, urlsplit
+
+import SEC_insider
+import SEC_Institution
+import SEC_replay
+from SEC_form4 import get_form4
+from SEC_metrics import Metrics
+
+PREFIX = 'https://www.sec.gov'
+
+
+def timed(stats, stage, func, *args):
+    # call func, adding its latency to the stage
+    start = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        stats.record(stage, time.perf_counter() - start)
+
+
+def bench_insider(corpus, stats):
+    # own-disp page -> raw form4 -> records, for every reporter whose own-disp page is in the corpus
+    filings = rows = 0
+    for url in corpus.urls():
+        if 'own-disp' not in url:
+            continue
+        cik = int(parse_qs(urlsplit(url).query)['CIK'][0])
+        entry = timed(stats, 'owner', SEC_insider.get_owner_entry, cik)
+        if entry is None:
+            continue
+        form4 = timed(stats, 'form4', get_form4, entry['FormURL'])
+        if form4 is None:
+            continue
+        # a known symbol keeps the registry, and so the database, out of the measurement
+        cik_dict = {entry['IssuerCIK']: form4['Symbol'] or 'BENCH'}
+        records = timed(stats, 'records', SEC_insider.get_form4_records, entry, cik_dict, form4)
+        filings += 1
+        rows += len(records)
+    return filings, rows
+
+
+def count_13F(link, date):
+    # holdings of a 13F filing, streamed chunk by chunk as on the way to the writer
+    return sum(len(chunk) for chunk in SEC_Institution.get_13F_chunks(link, date))
+
+
+def bench_13F(corpus, stats):
+    # filing history -> 13F filings, for every 13F filing history page in the corpus
+    filings = rows = 0
+    for url in corpus.urls():
+        if 'action=getcompany' not in url or 'type=13F' not in url:
+            continue
+        history = timed(stats, 'history', SEC_Institution.get_filing_list, url[len(PREFIX):],
+                        SEC_Institution.HISTORY_LIMIT)
+        for document, filed_date in history:
+            filings += 1
+            rows += timed(stats, '13F', count_13F, document, filed_date)
+    return filings, rows
+
+
+def run_suite(name, bench, corpus, repeat=1, memory=False):
+    # run a benchmark repeat times and report throughput and per-stage latency;
+    # peak memory comes from one extra pass, since tracing slows the parsers down
+    stats = Metrics()
+    filings = rows = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        n_filings, n_rows = bench(corpus, stats)
+        filings += n_filings
+        rows += n_rows
+    seconds = time.perf_counter() - start
+    result = {'Suite': name, 'Filings': filings, 'Rows': rows, 'Seconds': round(seconds, 3),
+              'FilingsPerSec': round(filings / seconds, 1) if seconds else 0,
+              'RowsPerSec': round(rows / seconds, 1) if seconds else 0, 'Stages': stats.summary()}
+    if memory:
+        tracemalloc.start()
+        bench(corpus, Metrics())
+        result['PeakMemoryMB'] = round(tracemalloc.get_traced_memory()[1] / 1024 ** 2, 2)
+        tracemalloc.stop()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark of the SEC Form 4 and 13F parsers.')
+    parser.add_argument('corpus', help='fixture corpus directory')
+    parser.add_argument('--repeat', type=int, default=1, help='passes over the corpus')
+    parser.add_argument('--memory', action='store_true', help='also measure peak memory in one traced pass')
+    parser.add_argument('--record', choices=('insider', '13F'), help='capture the corpus from a live run instead')
+    args = parser.parse_args()
+    if args.record:
+        SEC_replay.record(args.corpus)
+        if args.record == 'insider':
+            SEC_insider.main()
+        else:
+            SEC_Institution.main()
+        return
+    corpus = SEC_replay.replay(args.corpus)
+    for name, bench in (('insider', bench_insider), ('13F', bench_13F)):
+        print(json.dumps(run_suite(name, bench, corpus, args.repeat, args.memory), indent=1))
+
+
+if __name__ == '__main__':
+    main()
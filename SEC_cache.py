@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+CACHE_DIR = 'cache.sec'
+CACHE_MAX_BYTES = 2 * 1024 ** 3 # compressed size kept on disk before least recently used pages are evicted
+# seconds a cached page is served without revalidation, by url fragment; None never revalidates
+CACHE_TTL = (('/Archives/edgar/data/', None), # filed documents never change
+             ('action=getcurrent', 0), # current filing listings, polled for new filings
+             ('/cgi-bin/browse-edgar', 60), # filing histories
+             ('/cgi-bin/own-disp', 0)) # insider transaction pages, whose first entry is the newest filing
+DEFAULT_TTL = 3600
+
+
+def get_ttl(url):
+    for fragment, ttl in CACHE_TTL:
+        if fragment in url:
+            return ttl
+    return DEFAULT_TTL
+
+
+class PageCache:
+    # on-disk cache of http responses keyed by url hash: a gzip body plus a json sidecar with the
+    # validators (ETag, Last-Modified), evicting least recently used pages above max_bytes
+
+    def __init__(self, path=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.sizes = None # key -> (compressed size, last used), scanned on first use
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        folder = os.path.join(self.path, key[:2])
+        return key, os.path.join(folder, key + '.json'), os.path.join(folder, key + '.gz')
+
+    def _scan(self):
+        # build the size index from the files on disk, once per process
+        if self.sizes is not None:
+            return
+        self.sizes = dict()
+        self.total = 0
+        if not os.path.isdir(self.path):
+            return
+        for folder in os.scandir(self.path):
+            if not folder.is_dir():
+                continue
+            for f in os.scandir(folder.path):
+                if f.name.endswith('.gz'):
+                    stat = f.stat()
+                    self.sizes[f.name[:-3]] = (stat.st_size, stat.st_mtime)
+                    self.total += stat.st_size
+
+    def get(self, url):
+        # cached metadata of a url, None if not cached
+        key, meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return meta if os.path.exists(body_path) else None
+
+    def fresh(self, meta):
+        ttl = get_ttl(meta['URL'])
+        return ttl is None or time.time() - meta['Checked'] < ttl
+
+    def headers(self, meta):
+        # conditional request headers revalidating a cached page
+        headers = dict()
+        if meta.get('ETag'):
+            headers['If-None-Match'] = meta['ETag']
+        if meta.get('LastModified'):
+            headers['If-Modified-Since'] = meta['LastModified']
+        return headers
+
+    def response(self, meta):
+        # rebuild the cached response, None if the body cannot be read
+        key, meta_path, body_path = self._paths(meta['URL'])
+        try:
+            with gzip.open(body_path, 'rb') as f:
+                content = f.read()
+            os.utime(body_path)
+        except (OSError, EOFError):
+            return None
+        with self.lock:
+            if self.sizes is not None and key in self.sizes:
+                self.sizes[key] = (self.sizes[key][0], time.time())
+        r = requests.Response()
+        r.status_code = 200
+        r.url = meta['URL']
+        r.encoding = meta['Encoding']
+        r.headers = CaseInsensitiveDict(meta['Headers'])
+        r._content = content
+        return r
+
+    def revalidated(self, meta):
+        # a 304 answer: the cached page is good for another ttl
+        meta['Checked'] = time.time()
+        self._write_meta(meta)
+
+    def storable(self, url, r):
+        # False for a response that could never be served from disk: a page revalidated on every fetch
+        # (ttl 0) without an ETag or Last-Modified to revalidate it with would only be rewritten each time
+        return get_ttl(url) != 0 or bool(r.headers.get('ETag') or r.headers.get('Last-Modified'))
+
+    def put(self, url, r):
+        # store a 200 response to url
+        key, meta_path, body_path = self._paths(url)
+        os.makedirs(os.path.dirname(body_path), exist_ok=True)
+        tmp = '%s.%d.tmp' % (body_path, threading.get_ident())
+        with gzip.open(tmp, 'wb') as f:
+            f.write(r.content)
+        os.replace(tmp, body_path)
+        headers = {k: v for k, v in r.headers.items() if k.lower() in ('content-type', 'etag', 'last-modified')}
+        self._write_meta({'URL': url, 'Encoding': r.encoding, 'Headers': headers,
+                          'ETag': r.headers.get('ETag'), 'LastModified': r.headers.get('Last-Modified'),
+                          'Checked': time.time()})
+        size = os.path.getsize(body_path)
+        with self.lock:
+            self._scan()
+            old = self.sizes.get(key, (0, 0))[0]
+            self.sizes[key] = (size, time.time())
+            self.total += size - old
+            over = self.total > self.max_bytes
+        if over:
+            self.evict()
+
+    def _write_meta(self, meta):
+        key, meta_path, body_path = self._paths(meta['URL'])
+        tmp = '%s.%d.tmp' % (meta_path, threading.get_ident())
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp, meta_path)
+
+    def evict(self):
+        # drop least recently used pages until the cache is back under 90% of max_bytes
+        with self.lock:
+            self._scan()
+            victims = sorted(self.sizes.items(), key=lambda item: item[1][1])
+            target = self.max_bytes * 0.9
+            removed = list()
+            for key, (size, used) in victims:
+                if self.total <= target:
+                    break
+                self.total -= size
+                removed.append(key)
+                del self.sizes[key]
+        for key in removed:
+            folder = os.path.join(self.path, key[:2])
+            for name in (key + '.json', key + '.gz'):
+                try:
+                    os.remove(os.path.join(folder, name))
+                except OSError:
+                    pass
@@ -0,0 +1,407 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import atexit
+import threading
+import time
+
+from pymongo import DeleteOne, ReplaceOne
+from pymongo.errors import AutoReconnect, BulkWriteError, NetworkTimeout
+from MongoDB.client import DevDB
+from SEC_metrics import log, METRICS
+
+from datetime import datetime, timedelta
+
+CIK_FLUSH_SIZE = 200 # dirty CIK entries written in one bulk_write
+CIK_FLUSH_INTERVAL = 60 # seconds before dirty CIK entries are written anyway
+WRITE_BATCH_SIZE = 1000 # documents buffered before an insert_many
+WRITE_INTERVAL = 30 # seconds before buffered documents are written anyway
+WRITE_RETRIES = 3 # retries of a batch after a transient error, with doubling backoff
+WRITE_BACKOFF = 1
+DUPLICATE_KEY = 11000
+JOURNAL_STATES = ('pending', 'fetched', 'parsed', 'written') # work item states, in order
+FINISHED = ('written', 'failed') # states of the work items no longer worked on
+JOURNAL_ATTEMPTS = 5 # failed attempts before a work item is given up as 'failed'
+JOURNAL_BACKOFF = 300 # seconds before the first retry of a failed work item, doubling per attempt
+JOURNAL_FLUSH_SIZE = 200 # changed work items written in one bulk_write
+JOURNAL_FLUSH_INTERVAL = 15 # seconds before changed work items are written anyway
+JOURNAL_KEEP_DAYS = 7 # written and failed work items are kept this long to recognise them when seen again
+WATERMARK_LAG = 300 # seconds; documents stamped more recently may still be in flight in an insert_many
+
+indexed = set()
+indexed_lock = threading.Lock()
+
+
+def ensure_index(collection, keys):
+    # create an index once per process instead of on every write
+    key = (collection, tuple(keys))
+    with indexed_lock:
+        if key in indexed:
+            return
+        DevDB.create_index(collection, keys)
+        indexed.add(key)
+
+
+def load_watermark(checkpoint):
+    # UpdateTime up to which the job of the checkpoint has read, None before its first run
+    found = list(DevDB.find('MA_SEC_Checkpoint', {'_id': checkpoint}))
+    return found[0]['Until'] if found else None
+
+
+def save_watermark(checkpoint, until):
+    record = {'Until': until, 'UpdateTime': datetime.now(), '_id': checkpoint}
+    DevDB.replace_one('MA_SEC_Checkpoint', {'_id': checkpoint}, record, upsert=True)
+
+
+def get_window(checkpoint, rebuild=False):
+    # [since, until) of UpdateTime for the next run of an incremental job: from its watermark, None on
+    # a rebuild or a first run, to WATERMARK_LAG ago, so runs neither overlap nor miss documents
+    since = None if rebuild else load_watermark(checkpoint)
+    return since, datetime.now() - timedelta(seconds=WATERMARK_LAG)
+
+
+class CIKRegistry:
+    # in-process view of MA_SEC_CIKList: symbols resolved during the run are remembered, and new or
+    # changed entries are coalesced into periodic bulk upserts
+
+    def __init__(self, flush_size=CIK_FLUSH_SIZE, flush_interval=CIK_FLUSH_INTERVAL):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.symbols = dict() # issuer cik -> symbol, shared with the scrapers as their cik_dict
+        self.entries = dict() # (cik, type) -> (name, symbol) as stored
+        self.dirty = dict() # (cik, type) -> record waiting to be written
+        self.lock = threading.RLock()
+        self.flushed = time.monotonic()
+
+    def load(self):
+        # load the issuer cik dictionary from MongoDB
+        ensure_index('MA_SEC_CIKList', [('CIK', 1), ('Type', 1)])
+        with self.lock:
+            for cik in DevDB.find('MA_SEC_CIKList', {'Type': 'Issuer'}):
+                self.symbols[cik['CIK']] = cik['Symbol']
+                self.entries[(cik['CIK'], 'Issuer')] = (cik.get('CompanyName'), cik['Symbol'])
+        return self.symbols
+
+    def update(self, cik, name, cik_type, symbol=None):
+        # record a cik, writing it only if it is new or changed
+        if type(symbol) == list:
+            symbol = symbol[0]
+        key = (cik, cik_type)
+        with self.lock:
+            if cik_type == 'Issuer':
+                self.symbols[cik] = symbol
+            if self.entries.get(key) == (name, symbol):
+                return True
+            self.entries[key] = (name, symbol)
+            record = {'CIK': cik, 'CompanyName': name, 'Type': cik_type,
+                      'UpdateTime': datetime.now(), '_id': {'CIK': cik, 'Type': cik_type}}
+            if cik_type == 'Issuer':
+                record['Symbol'] = symbol
+            self.dirty[key] = record
+            due = len(self.dirty) >= self.flush_size or time.monotonic() - self.flushed > self.flush_interval
+        if due:
+            return self.flush()
+        return True
+
+    def flush(self):
+        # upsert the dirty entries in one unordered bulk_write; failed entries stay dirty
+        with self.lock:
+            records = list(self.dirty.values())
+            self.dirty.clear()
+            self.flushed = time.monotonic()
+        if not records:
+            return True
+        requests = [ReplaceOne({'_id': record['_id']}, record, upsert=True) for record in records]
+        try:
+            with METRICS.timer('write.MA_SEC_CIKList'):
+                DevDB.bulk_write('MA_SEC_CIKList', requests, ordered=False)
+            return True
+        except BulkWriteError as e:
+            failed = [records[error['index']] for error in e.details['writeErrors']]
+            reason = e
+        except Exception as e:
+            failed = records
+            reason = e
+        log.error('update CIKList error', error=str(reason), failed=len(failed), entries=len(records))
+        with self.lock:
+            for record in failed:
+                self.dirty.setdefault((record['CIK'], record['Type']), record)
+        return False
+
+
+CIKS = CIKRegistry()
+atexit.register(CIKS.flush)
+
+
+class BatchWriter:
+    # buffers documents for one collection across calls and writes them with unordered insert_many,
+    # flushing by size or age; duplicates are counted apart from real failures
+
+    def __init__(self, collection, keys, batch_size=WRITE_BATCH_SIZE, interval=WRITE_INTERVAL,
+                 retries=WRITE_RETRIES):
+        self.collection = collection
+        self.keys = keys
+        self.batch_size = batch_size
+        self.interval = interval
+        self.retries = retries
+        self.buffer = list()
+        self.callbacks = list()
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.flushed = time.monotonic()
+        self.counts = {'Inserted': 0, 'Duplicates': 0, 'Failed': 0, 'Retries': 0, 'Batches': 0}
+        atexit.register(self.flush)
+
+    def add(self, documents, callback=None):
+        # buffer documents; callback runs once they are all stored or found to be duplicates
+        with self.lock:
+            self.buffer.extend(documents)
+            if callback is not None:
+                self.callbacks.append(callback)
+            due = len(self.buffer) >= self.batch_size or time.monotonic() - self.flushed > self.interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        # write out everything buffered so far
+        with self.flush_lock:
+            with self.lock:
+                documents, self.buffer = self.buffer, list()
+                callbacks, self.callbacks = self.callbacks, list()
+                self.flushed = time.monotonic()
+            failed = 0
+            for start in range(0, len(documents), self.batch_size):
+                failed += self.write(documents[start:start + self.batch_size])
+            if failed:
+                log.error('documents not written', collection=self.collection, failed=failed,
+                          callbacks_dropped=len(callbacks))
+                return False
+            for callback in callbacks:
+                callback()
+            return True
+
+    def write(self, documents):
+        # insert one batch, retrying transient errors; returns the number of documents not written.
+        # UpdateTime is stamped right before each insert, so readers following it with a watermark
+        # only need to stay WATERMARK_LAG behind and never miss documents that sat in the buffer
+        ensure_index(self.collection, self.keys)
+        self.count('Batches', 1)
+        for attempt in range(self.retries + 1):
+            update_time = datetime.now()
+            for document in documents:
+                document['UpdateTime'] = update_time
+            try:
+                with METRICS.timer('write.' + self.collection):
+                    result = DevDB.insert_many(self.collection, documents, ordered=False)
+                self.count('Inserted', len(result.inserted_ids))
+                return 0
+            except BulkWriteError as e:
+                errors = e.details['writeErrors']
+                duplicates = sum(1 for error in errors if error['code'] == DUPLICATE_KEY)
+                self.count('Inserted', e.details['nInserted'])
+                self.count('Duplicates', duplicates)
+                self.count('Failed', len(errors) - duplicates)
+                return len(errors) - duplicates
+            except (AutoReconnect, NetworkTimeout) as e:
+                if attempt == self.retries:
+                    log.error('write error', collection=self.collection, error=str(e))
+                    break
+                self.count('Retries', 1)
+                time.sleep(WRITE_BACKOFF * 2 ** attempt)
+        self.count('Failed', len(documents))
+        return len(documents)
+
+    def count(self, field, n):
+        with self.lock:
+            self.counts[field] += n
+        METRICS.count('%s.%s' % (self.collection, field.lower()), n)
+
+    def report(self):
+        log.info('writer', collection=self.collection, **self.counts)
+
+
+class Journal:
+    # durable journal of the work items of a job in MA_SEC_Journal: each discovered item moves
+    # pending -> fetched -> parsed -> written, keeping the data of its last state, so an interrupted run
+    # resumes unfinished items where they stopped; failed items are retried with backoff up to a cap.
+    # Only unfinished items are held whole; written and given-up items are kept as their key and state
+    # once stored, so memory stays small over a backfill of millions of filings
+
+    def __init__(self, job, attempts=JOURNAL_ATTEMPTS, backoff=JOURNAL_BACKOFF,
+                 flush_size=JOURNAL_FLUSH_SIZE, flush_interval=JOURNAL_FLUSH_INTERVAL):
+        self.job = job
+        self.attempts = attempts
+        self.backoff = backoff
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.entries = dict() # key -> journal record of the unfinished and not yet stored items
+        self.finished = dict() # key -> 'written' or 'failed' of the stored finished items
+        self.dirty = set()
+        self.lock = threading.RLock()
+        self.flush_lock = threading.Lock()
+        self.flushed = time.monotonic()
+        atexit.register(self.flush)
+
+    def load(self):
+        # read the journal of the job, dropping finished items older than JOURNAL_KEEP_DAYS; loading
+        # again, e.g. once a day in a long-running process, replaces the items held once they are written
+        ensure_index('MA_SEC_Journal', [('Job', 1), ('State', 1)])
+        expired = datetime.now() - timedelta(days=JOURNAL_KEEP_DAYS)
+        stale = list()
+        if not self.flush():
+            return self
+        with self.lock:
+            self.entries.clear()
+            self.finished.clear()
+            query = {'Job': self.job, 'State': {'$in': list(FINISHED)}}
+            for record in DevDB.find('MA_SEC_Journal', query, {'Key': 1, 'State': 1, 'UpdateTime': 1}):
+                if record['UpdateTime'] < expired:
+                    stale.append(DeleteOne({'_id': record['_id']}))
+                else:
+                    self.finished[record['Key']] = record['State']
+            query = {'Job': self.job, 'State': {'$in': [state for state in JOURNAL_STATES if state not in FINISHED]}}
+            for record in DevDB.find('MA_SEC_Journal', query):
+                self.entries[record['Key']] = record
+        if stale:
+            try:
+                DevDB.bulk_write('MA_SEC_Journal', stale, ordered=False)
+            except Exception as e:
+                log.warning('prune journal error', job=self.job, error=str(e))
+        return self
+
+    def add(self, key, data):
+        # journal a newly discovered item as pending; False if the item is already journaled
+        with self.lock:
+            if key in self.entries or key in self.finished:
+                return False
+            self.entries[key] = {'Job': self.job, 'Key': key, 'State': 'pending', 'Attempts': 0,
+                                 'NextTry': datetime.now(), 'Error': '', 'Data': data,
+                                 '_id': {'Job': self.job, 'Key': key}}
+            due = self.touch(key)
+        if due:
+            self.flush()
+        return True
+
+    def discover(self, items, key):
+        # (key, item) pairs of the items not journaled yet, journaling each as pending
+        for item in items:
+            k = key(item)
+            if self.add(k, item):
+                yield k, item
+
+    def resumable(self):
+        # (key, data of the last state) of the unfinished items due for another attempt
+        now = datetime.now()
+        with self.lock:
+            return [(key, record['Data']) for key, record in self.entries.items()
+                    if record['State'] not in FINISHED and record['NextTry'] <= now]
+
+    def reached(self, key, state):
+        with self.lock:
+            current = self.entries[key]['State'] if key in self.entries else self.finished.get(key)
+        return current in JOURNAL_STATES and JOURNAL_STATES.index(current) >= JOURNAL_STATES.index(state)
+
+    def advance(self, key, state, data=None):
+        # move an item to a later state, keeping the data needed to resume from there; an item already
+        # finished and stored is left as it is
+        with self.lock:
+            record = self.entries.get(key)
+            if record is None:
+                return
+            record['State'] = state
+            record['Data'] = data
+            record['Error'] = ''
+            due = self.touch(key)
+        if due:
+            self.flush()
+
+    def written(self, key):
+        self.advance(key, 'written')
+
+    def fail(self, key, error):
+        # count a failed attempt: the item keeps its state and waits a doubling backoff before the next
+        # attempt, or is given up once it has used all attempts
+        with self.lock:
+            record = self.entries.get(key)
+            if record is None:
+                return
+            record['Attempts'] += 1
+            record['Error'] = str(error)[:500]
+            if record['Attempts'] >= self.attempts:
+                record['State'] = 'failed'
+            record['NextTry'] = datetime.now() + timedelta(seconds=self.backoff * 2 ** (record['Attempts'] - 1))
+            due = self.touch(key)
+        if due:
+            self.flush()
+
+    def stage(self, state, func):
+        # wrap a pipeline stage func to run on (key, item) pairs: the item moves to state with the result
+        # as its data, items resumed at or past state skip func, and a None result finishes the item
+        def run(pair):
+            key, item = pair
+            if self.reached(key, state):
+                return pair
+            try:
+                result = func(item)
+            except Exception as e:
+                self.fail(key, e)
+                raise
+            if result is None:
+                self.written(key)
+                return None
+            self.advance(key, state, result)
+            return key, result
+        return run
+
+    def touch(self, key):
+        # queue a changed item for the next bulk write (lock held); True once a flush is due
+        self.entries[key]['UpdateTime'] = datetime.now()
+        self.dirty.add(key)
+        return len(self.dirty) >= self.flush_size or time.monotonic() - self.flushed > self.flush_interval
+
+    def flush(self):
+        # upsert the changed items in one unordered bulk_write; failed items stay dirty. Flushes are
+        # serialised so an older snapshot of an item can never overwrite a newer one
+        with self.flush_lock:
+            with self.lock:
+                records = [dict(self.entries[key]) for key in self.dirty]
+                self.dirty.clear()
+                self.flushed = time.monotonic()
+            if not records:
+                return True
+            requests = [ReplaceOne({'_id': record['_id']}, record, upsert=True) for record in records]
+            try:
+                with METRICS.timer('write.MA_SEC_Journal'):
+                    DevDB.bulk_write('MA_SEC_Journal', requests, ordered=False)
+                failed = list()
+            except BulkWriteError as e:
+                failed = [records[error['index']] for error in e.details['writeErrors']]
+                reason = e
+            except Exception as e:
+                failed = records
+                reason = e
+            with self.lock:
+                self.dirty.update(record['Key'] for record in failed)
+                for record in records:
+                    # a finished item unchanged since its snapshot is stored, only its state is kept
+                    key = record['Key']
+                    if record['State'] in FINISHED and key not in self.dirty and key in self.entries:
+                        del self.entries[key]
+                        self.finished[key] = record['State']
+            if not failed:
+                return True
+            log.error('update journal error', job=self.job, error=str(reason), failed=len(failed), items=len(records))
+            return False
+
+    def summary(self):
+        # number of journaled items per state
+        counts = dict()
+        with self.lock:
+            for record in self.entries.values():
+                counts[record['State']] = counts.get(record['State'], 0) + 1
+            for state in self.finished.values():
+                counts[state] = counts.get(state, 0) + 1
+        return counts
+
+    def report(self):
+        log.info('journal', job=self.job, **self.summary())
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Columnar export of MA_SEC_Form4 and MA_SEC_13F to Parquet, partitioned by filing quarter:
+#   python SEC_export.py [form4] [13F] [--root DIR]   append what was stored since the last export
+#   python SEC_export.py 13F --rebuild                  drop the 13F export and write it again from scratch
+# Read back with pyarrow.dataset.dataset(DIR + '/form4', partitioning='hive').
+
+import argparse
+import os
+import shutil
+import uuid
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from MongoDB.client import DevDB
+
+from datetime import datetime
+from SEC_db import ensure_index, get_window, save_watermark
+from SEC_metrics import log, METRICS
+
+EXPORT_DIR = 'export.sec'
+EXPORT_BATCH = 50000 # documents converted and written at once
+COMPRESSION = 'zstd'
+CATEGORY = pa.dictionary(pa.int32(), pa.string()) # dictionary-encoded strings with few distinct values
+DATE = pa.date32()
+TIMESTAMP = pa.timestamp('ms')
+
+# (column, document field, type) of each exported collection; _id only repeats other fields and is dropped
+FORM4_COLUMNS = (('Symbol', 'Symbol', CATEGORY), ('IssuerCIK', 'IssuerCIK', pa.int64()),
+                 ('ReporterCIK', 'ReporterCIK', pa.int64()), ('BuySell', 'Buy/Sell', CATEGORY),
+                 ('TransactionDate', 'TransactionDate', DATE), ('TransactionType', 'TransactionType', CATEGORY),
+                 ('DirectIndirect', 'Direct/Indirect', CATEGORY), ('TransactedAmt', 'TransactedAmt', pa.int64()),
+                 ('OwnedAmt', 'OwnedAmt', pa.int64()), ('Price', 'Price', pa.float64()),
+                 ('SecurityName', 'SecurityName', CATEGORY), ('Relationship', 'Relationship', CATEGORY),
+                 ('LineNumber', 'LineNumber', pa.int32()), ('FormURL', 'FormURL', pa.string()),
+                 ('FiledDate', 'FiledDate', DATE), ('UpdateTime', 'UpdateTime', TIMESTAMP))
+COLUMNS_13F = (('CIK', 'CIK', pa.int64()), ('FiledDate', 'FiledDate', DATE), ('CUSIP', 'CUSIP', CATEGORY),
+               ('Name', 'Name', CATEGORY), ('Class', 'Class', CATEGORY), ('Value', 'Value', pa.float64()),
+               ('Amount', 'Amount', pa.int64()), ('AMTType', 'AMTType', CATEGORY),
+               ('InvestmentDiscretion', 'InvestmentDiscretion', CATEGORY), ('Other', 'Other', CATEGORY),
+               ('VotingSole', 'VotingSole', pa.int64()), ('VotingShared', 'VotingShared', pa.int64()),
+               ('VotingNone', 'VotingNone', pa.int64()), ('FormURL', 'FormURL', CATEGORY),
+               ('FormType', 'FormType', CATEGORY), ('Period', 'Period', DATE), ('UpdateTime', 'UpdateTime', TIMESTAMP))
+EXPORTS = {'form4': ('MA_SEC_Form4', FORM4_COLUMNS), '13F': ('MA_SEC_13F', COLUMNS_13F)}
+
+dates = dict() # 'YYYY-MM-DD' -> date, filing dates repeat on most rows
+
+
+def to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if not value:
+        return None
+    result = dates.get(value)
+    if result is None:
+        try:
+            result = datetime.strptime(value[:10], '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            return None
+        dates[value] = result
+    return result
+
+
+def to_int(value):
+    # share counts were stored as ints, floats or text with thousands separators over time
+    if isinstance(value, int) or value is None:
+        return value
+    try:
+        return int(float(str(value).replace(',', '')))
+    except ValueError:
+        return None
+
+
+def to_float(value):
+    if isinstance(value, float) or value is None:
+        return value
+    try:
+        return float(str(value).replace(',', ''))
+    except ValueError:
+        return None
+
+
+def to_text(value):
+    return value if value is None or isinstance(value, str) else str(value)
+
+
+def get_converter(column_type):
+    if column_type == DATE:
+        return to_date
+    if pa.types.is_integer(column_type):
+        return to_int
+    if pa.types.is_floating(column_type):
+        return to_float
+    if column_type == TIMESTAMP:
+        return lambda value: value if isinstance(value, datetime) else None
+    return to_text
+
+
+def get_schema(columns):
+    return pa.schema([(name, column_type) for name, field, column_type in columns])
+
+
+def to_batch(documents, columns, schema):
+    # documents -> one typed arrow record batch
+    arrays = list()
+    for name, field, column_type in columns:
+        convert = get_converter(column_type)
+        values = [convert(document.get(field)) for document in documents]
+        if pa.types.is_dictionary(column_type):
+            arrays.append(pa.array(values, type=pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, type=column_type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def get_quarter(value):
+    # partition of a document: quarter of its filed date, e.g. '2024Q1'
+    date = to_date(value)
+    if date is None:
+        return 'unknown'
+    return '%dQ%d' % (date.year, (date.month - 1) // 3 + 1)
+
+
+class PartitionWriter:
+    # one parquet file per quarter for this export run, <root>/FiledQuarter=<quarter>/part-<run>.parquet;
+    # files are written under a .tmp name and only renamed into the dataset once complete
+
+    def __init__(self, root, schema, run):
+        self.root = root
+        self.schema = schema
+        self.run = run
+        self.writers = dict() # quarter -> (ParquetWriter, tmp path, final path)
+        self.rows = 0
+
+    def write(self, quarter, batch):
+        if quarter not in self.writers:
+            folder = os.path.join(self.root, 'FiledQuarter=%s' % quarter)
+            os.makedirs(folder, exist_ok=True)
+            path = os.path.join(folder, 'part-%s.parquet' % self.run)
+            writer = pq.ParquetWriter(path + '.tmp', self.schema, compression=COMPRESSION)
+            self.writers[quarter] = (writer, path + '.tmp', path)
+        self.writers[quarter][0].write_batch(batch)
+        self.rows += batch.num_rows
+
+    def close(self):
+        # publish the completed files
+        for writer, tmp, path in self.writers.values():
+            writer.close()
+            os.replace(tmp, path)
+        return sorted(self.writers)
+
+    def abort(self):
+        for writer, tmp, path in self.writers.values():
+            writer.close()
+            os.remove(tmp)
+
+
+def export(name, root=EXPORT_DIR, rebuild=False, batch_size=EXPORT_BATCH):
+    # append the documents stored since the last export to the parquet dataset <root>/<name>; each run
+    # covers the UpdateTime window of SEC_db.get_window
+    collection, columns = EXPORTS[name]
+    schema = get_schema(columns)
+    folder = os.path.join(root, name)
+    if rebuild and os.path.isdir(folder):
+        shutil.rmtree(folder)
+    since, until = get_window('Export.' + collection, rebuild)
+    query = {'$lt': until} if since is None else {'$gte': since, '$lt': until}
+    ensure_index(collection, [('UpdateTime', 1)])
+    # the run id orders the files by window end and, with its random suffix, keeps two runs ending in the
+    # same microsecond from replacing each other's files
+    run = '%s-%s' % (until.strftime('%Y%m%d%H%M%S%f'), uuid.uuid4().hex[:8])
+    writer = PartitionWriter(folder, schema, run)
+    quarters = dict() # quarter -> documents waiting for the next batch
+    pending = 0
+    try:
+        for document in DevDB.find(collection, {'UpdateTime': query}):
+            quarters.setdefault(get_quarter(document.get('FiledDate')), list()).append(document)
+            pending += 1
+            if pending >= batch_size:
+                write_batches(writer, quarters, columns, schema)
+                pending = 0
+        write_batches(writer, quarters, columns, schema)
+    except Exception:
+        writer.abort()
+        raise
+    written = writer.close()
+    save_watermark('Export.' + collection, until)
+    METRICS.count('exported.' + name, writer.rows)
+    log.info('export', name=name, rows=writer.rows, quarters=written, since=str(since), until=str(until))
+    return writer.rows
+
+
+def write_batches(writer, quarters, columns, schema):
+    with METRICS.timer('write.parquet'):
+        for quarter, documents in quarters.items():
+            if documents:
+                writer.write(quarter, to_batch(documents, columns, schema))
+    quarters.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the SEC collections to partitioned Parquet.')
+    parser.add_argument('names', nargs='*', help='collections to export, form4 and/or 13F (default: all)')
+    parser.add_argument('--root', default=EXPORT_DIR, help='dataset root directory')
+    parser.add_argument('--rebuild', action='store_true', help='drop the existing export and write it from scratch')
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in EXPORTS:
+            parser.error('unknown collection %s (choose from %s)' % (name, ', '.join(sorted(EXPORTS))))
+    for name in args.names or sorted(EXPORTS):
+        export(name, args.root, args.rebuild)
+
+
+if __name__ == '__main__':
+    main()
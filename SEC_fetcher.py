@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import atexit
+import queue
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.chrome.options import Options
+
+from latest_user_agents import get_latest_user_agents
+from SEC_cache import PageCache
+from SEC_metrics import log, METRICS
+
+import sys
+
+CHROMEDRIVER = '/usr/bin/chromedriver'
+POOL_SIZE = 2 # number of long-lived chromedrivers
+MAX_PAGES = 200 # recycle a chromedriver after serving this many pages
+FETCH_RETRIES = 2
+FETCH_MODE = 'http' # 'http' tries the keep-alive session first, 'browser' always uses chromedriver
+HTTP_POOL_SIZE = 10 # keep-alive connections per host
+HTTP_TIMEOUT = 30
+RATE_LIMIT = 10 # SEC fair access: at most 10 requests per second across all threads
+CACHE_ENABLED = True # keep http responses in an on-disk cache, see SEC_cache.py
+# pages SEC serves instead of the requested content when it throttles or blocks a client
+BLOCKED_MARKERS = ('Request Rate Threshold Exceeded', 'Undeclared Automated Tool')
+
+
+class FetchError(Exception):
+    # a page or document could not be fetched
+    pass
+
+
+def user_agent():
+    # get latest user agents
+    user_agents = get_latest_user_agents()
+    user_agent = ''
+    for i in user_agents:
+        if sys.platform == 'darwin' and ('Macintosh' in i):
+            user_agent = i
+        if sys.platform == 'linux' and ('Linux' in i) and ('Android' not in i):
+            user_agent = i
+    if not user_agent:
+        user_agent = user_agents[4]
+    return user_agent
+
+
+USER_AGENT = None # looked up on first use by get_user_agent(), as the lookup may go to the network
+user_agent_lock = threading.Lock()
+
+
+def get_user_agent():
+    # the user agent of every request, also set on the http session once known
+    global USER_AGENT
+    if USER_AGENT is None:
+        with user_agent_lock:
+            if USER_AGENT is None:
+                SESSION.headers['User-Agent'] = user_agent()
+                USER_AGENT = SESSION.headers['User-Agent']
+    return USER_AGENT
+
+
+def new_driver():
+    # create a headless chromedriver
+    chrome_options = Options()
+    chrome_options.add_argument("--headless")
+    chrome_options.add_argument("start-maximized")
+    chrome_options.add_argument("disable-infobars")
+    chrome_options.add_argument("--disable-extensions")
+    chrome_options.add_argument("--window-size=1920x1080")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--user-agent=%s" % get_user_agent())
+    service = Service(CHROMEDRIVER)
+    return webdriver.Chrome(options=chrome_options, service=service)
+
+
+def quit_driver(driver):
+    # quit a chromedriver, ignoring a browser that is already gone
+    try:
+        driver.quit()
+    except Exception as e:
+        log.warning('quit chromedriver error', error=str(e))
+
+
+class DriverPool:
+    # a bounded pool of long-lived chromedrivers shared by every get_html() call
+
+    def __init__(self, size=POOL_SIZE, max_pages=MAX_PAGES):
+        self.size = size
+        self.max_pages = max_pages
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+        self.pages = dict() # driver -> number of pages served
+        self.lock = threading.Lock()
+        self.created = 0
+        self.recycled = 0
+
+    def _create(self):
+        driver = new_driver()
+        with self.lock:
+            self.pages[driver] = 0
+            self.created += 1
+        return driver
+
+    def _discard(self, driver):
+        with self.lock:
+            self.pages.pop(driver, None)
+            self.recycled += 1
+        quit_driver(driver)
+
+    def _healthy(self, driver):
+        # a crashed browser or a dead chromedriver session raises here
+        try:
+            driver.current_url
+            return True
+        except Exception:
+            return False
+
+    def warm(self, n=None):
+        # start chromedrivers ahead of the first fetch
+        n = self.size if n is None else min(n, self.size)
+        while self.idle.qsize() < n:
+            self.idle.put(self._create())
+
+    def acquire(self):
+        # take an idle healthy chromedriver, creating one if the pool is not full
+        self.slots.acquire()
+        try:
+            while True:
+                try:
+                    driver = self.idle.get_nowait()
+                except queue.Empty:
+                    return self._create()
+                if self._healthy(driver):
+                    return driver
+                self._discard(driver)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self, driver, broken=False):
+        # return a chromedriver to the pool, recycling it if broken or worn out
+        try:
+            with self.lock:
+                self.pages[driver] = self.pages.get(driver, 0) + 1
+                worn = self.pages[driver] >= self.max_pages
+            if broken or worn:
+                self._discard(driver)
+            else:
+                self.idle.put(driver)
+        finally:
+            self.slots.release()
+
+    def close(self):
+        # quit all idle chromedrivers
+        while True:
+            try:
+                driver = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(driver)
+
+
+class RateLimiter:
+    # token bucket shared by every request to SEC
+
+    def __init__(self, rate=RATE_LIMIT, burst=1):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.waited = 0.0
+
+    def acquire(self):
+        # block until a request may be sent
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+                self.waited += wait
+            time.sleep(wait)
+
+
+def new_session():
+    # create a keep-alive http session with connection reuse and gzip
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504),
+                  allowed_methods=('GET',))
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+    return session
+
+
+POOL = DriverPool()
+SESSION = new_session()
+LIMITER = RateLimiter()
+CACHE = PageCache() if CACHE_ENABLED else None
+REPLAY = None # a SEC_replay.Corpus answering every fetch instead of SEC, see SEC_replay.py
+RECORD = None # a SEC_replay.Corpus capturing every page fetched from SEC
+atexit.register(POOL.close)
+atexit.register(SESSION.close)
+
+
+def get_accession(link):
+    # accession number, without dashes, of an /Archives/edgar/data/<cik>/<accession>/... link
+    return link.split('/')[5]
+
+
+def page_ok(page, check=None):
+    # content check deciding whether a fetched page is usable or needs the browser
+    if not page or any(marker in page for marker in BLOCKED_MARKERS):
+        return False
+    if check is None:
+        return True
+    if callable(check):
+        return check(page)
+    return check in page
+
+
+def content_ok(content, check=None):
+    # page_ok on a raw response body, deciding whether it may be cached or served from the cache
+    if not content or any(marker.encode() in content for marker in BLOCKED_MARKERS):
+        return False
+    if check is None:
+        return True
+    if callable(check):
+        return check(content.decode('utf-8', 'replace'))
+    return check.encode() in content
+
+
+def http_get(url, check=None):
+    # fetch a response, from the replay corpus when one is set, None on a network error
+    if REPLAY is not None:
+        METRICS.count('pages')
+        return REPLAY.response(url)
+    r = fetch_response(url, check)
+    if r is not None:
+        METRICS.count('pages')
+    if RECORD is not None and r is not None and r.status_code == 200:
+        RECORD.add(url, r.content)
+    return r
+
+
+def fetch_response(url, check=None):
+    # fetch a response with the keep-alive http session, None on a network error; cached pages are
+    # served from disk while fresh and revalidated once stale. Only bodies passing the content check
+    # are cached, so a block page or a wrong document is fetched again instead of kept for good, and
+    # pages revalidated on every fetch only if they carry validators
+    meta = CACHE.get(url) if CACHE is not None else None
+    cached = None
+    if meta is not None:
+        start = time.perf_counter()
+        cached = CACHE.response(meta)
+        if cached is None or not content_ok(cached.content, check):
+            meta = cached = None
+        elif CACHE.fresh(meta):
+            METRICS.record('fetch.cache', time.perf_counter() - start)
+            METRICS.count('cache_hits')
+            return cached
+    get_user_agent()
+    LIMITER.acquire()
+    start = time.perf_counter()
+    try:
+        r = SESSION.get(url, headers=CACHE.headers(meta) if meta else None, timeout=HTTP_TIMEOUT)
+    except requests.RequestException as e:
+        METRICS.error('fetch.http')
+        log.warning('http fetch error', url=url, error=str(e))
+        return None
+    finally:
+        METRICS.record('fetch.http', time.perf_counter() - start)
+    if r.status_code == 304 and cached is not None:
+        CACHE.revalidated(meta)
+        METRICS.count('cache_revalidated')
+        return cached
+    if r.status_code == 200 and CACHE is not None and CACHE.storable(url, r) and content_ok(r.content, check):
+        try:
+            CACHE.put(url, r)
+        except OSError as e:
+            log.warning('cache write error', url=url, error=str(e))
+    return r
+
+
+def get_page(url):
+    # fetch a page with the keep-alive http session, None on failure
+    r = http_get(url)
+    if r is None or r.status_code != 200:
+        return None
+    return r.text
+
+
+def get_content(url, check=None):
+    # fetch raw response bytes with the keep-alive http session, None on failure; only bodies passing
+    # the content check are cached
+    r = http_get(url, check)
+    if r is None or r.status_code != 200:
+        return None
+    return r.content
+
+
+def get_html(url, check=None, mode=None):
+    # access the page html over http, falling back to the browser if the page fails the content check;
+    # FetchError if the browser page fails it too, so a block page never reaches a parser
+    if (mode or FETCH_MODE) == 'http':
+        r = http_get(url, check)
+        if r is not None and r.status_code == 404:
+            # a missing document is missing in the browser too
+            return r.text
+        if r is not None and r.status_code == 200 and page_ok(r.text, check):
+            return r.text
+        METRICS.count('browser_fallbacks')
+    page = get_browser_page(url)
+    if not page_ok(page, check):
+        raise FetchError('page failed the content check: ' + url)
+    return page
+
+
+def get_html_content(url, check=None, mode=None):
+    # get_html as raw bytes, sparing a decoded copy of large documents fetched over http
+    if (mode or FETCH_MODE) == 'http':
+        r = http_get(url, check)
+        if r is not None and r.status_code == 404:
+            return r.content
+        if r is not None and r.status_code == 200 and content_ok(r.content, check):
+            return r.content
+        METRICS.count('browser_fallbacks')
+    page = get_browser_page(url)
+    if not page_ok(page, check):
+        raise FetchError('page failed the content check: ' + url)
+    return page.encode('utf-8')
+
+
+def get_browser_page(url):
+    # access the page html with a pooled chromedriver
+    if REPLAY is not None:
+        METRICS.count('pages')
+        return REPLAY.response(url).text
+    for attempt in range(FETCH_RETRIES):
+        LIMITER.acquire()
+        start = time.perf_counter()
+        driver = POOL.acquire()
+        broken = False
+        try:
+            driver.get(url)
+            page_source = driver.page_source
+        except WebDriverException as e:
+            broken = True
+            METRICS.error('render.browser')
+            log.warning('chromedriver fetch error', url=url, attempt=attempt, error=str(e))
+            if attempt == FETCH_RETRIES - 1:
+                raise
+            continue
+        finally:
+            POOL.release(driver, broken)
+            METRICS.record('render.browser', time.perf_counter() - start)
+        METRICS.count('pages')
+        if RECORD is not None:
+            RECORD.add(url, page_source.encode('utf-8'))
+        return page_source
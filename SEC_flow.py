@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Insider net money flow per symbol, aggregated from MA_SEC_Form4 (or its Parquet export, see SEC_export.py):
+#   python SEC_flow.py             recompute the days and weeks with rows stored since the last update
+#   python SEC_flow.py --rebuild   recompute every day and week
+# Daily aggregates go to MA_SEC_InsiderFlow and weekly ones (weeks starting on Monday) to
+# MA_SEC_InsiderFlowWeekly; rolling windows are derived from the daily ones when read, see get_rolling.
+
+import argparse
+
+import numpy as np
+import pandas as pd
+from pymongo import ReplaceOne
+from MongoDB.client import DevDB
+
+from datetime import datetime, timedelta
+from SEC_db import ensure_index, get_window, save_watermark
+from SEC_metrics import log, METRICS
+
+FLOW_TYPES = ('P-Purchase', 'S-Sale') # open market trades; awards and other acquisitions move no money
+ROLE_WEIGHTS = (('officer', 2.0), ('director', 1.5)) # weight of the most senior role named in Relationship
+OTHER_WEIGHT = 1.0 # 10 percent owners and others
+ROLLING_DAYS = 30
+CHECKPOINT = 'Flow.Form4' # _id of the update watermark in MA_SEC_Checkpoint
+DAILY = 'MA_SEC_InsiderFlow'
+WEEKLY = 'MA_SEC_InsiderFlowWeekly'
+WRITE_BATCH_SIZE = 1000
+# (column, document field) read from MA_SEC_Form4; the columns are named as in the Parquet export
+FIELDS = (('Symbol', 'Symbol'), ('ReporterCIK', 'ReporterCIK'), ('BuySell', 'Buy/Sell'),
+          ('TransactionType', 'TransactionType'), ('TransactedAmt', 'TransactedAmt'), ('Price', 'Price'),
+          ('Relationship', 'Relationship'), ('TransactionDate', 'TransactionDate'))
+PROJECTION = dict({field: 1 for name, field in FIELDS}, _id=0) # reads only the FIELDS of MA_SEC_Form4 documents
+SUMS = ('NetFlow', 'WeightedFlow', 'BuyValue', 'SellValue', 'BuyShares', 'SellShares', 'Buys', 'Sells')
+
+
+def to_frame(documents):
+    # MA_SEC_Form4 documents -> data frame of the FIELDS columns
+    columns = {name: list() for name, field in FIELDS}
+    for document in documents:
+        for name, field in FIELDS:
+            columns[name].append(document.get(field))
+    return pd.DataFrame(columns)
+
+
+def read_export(root, symbols=None, start=None):
+    # insider rows of the Parquet export at <root>/form4, optionally of some symbols and transaction dates
+    import pyarrow.dataset as ds
+    dataset = ds.dataset(root + '/form4', format='parquet', partitioning='hive')
+    condition = None
+    if symbols is not None:
+        condition = ds.field('Symbol').isin(list(symbols))
+    if start is not None:
+        after = ds.field('TransactionDate') >= pd.Timestamp(start).date()
+        condition = after if condition is None else condition & after
+    table = dataset.to_table(columns=[name for name, field in FIELDS], filter=condition)
+    return table.to_pandas()
+
+
+def get_flows(rows):
+    # per-trade signed dollar flow (shares x price, sales negative), its role weighting and the
+    # buy/sell splits that the aggregates sum up
+    rows = rows[rows['TransactionType'].isin(FLOW_TYPES)]
+    date = pd.to_datetime(rows['TransactionDate'], errors='coerce')
+    shares = pd.to_numeric(rows['TransactedAmt'], errors='coerce').fillna(0).to_numpy(dtype=float)
+    price = pd.to_numeric(rows['Price'], errors='coerce').fillna(0).to_numpy(dtype=float)
+    sell = (rows['BuySell'] == 'S').to_numpy()
+    value = shares * price
+    flow = np.where(sell, -value, value)
+    role = rows['Relationship'].fillna('').astype(str).str.lower()
+    officer = role.str.contains('officer', regex=False).to_numpy()
+    director = role.str.contains('director', regex=False).to_numpy()
+    weight = np.select([role.str.contains(name, regex=False).to_numpy() for name, w in ROLE_WEIGHTS],
+                       [w for name, w in ROLE_WEIGHTS], OTHER_WEIGHT)
+    cik = pd.to_numeric(rows['ReporterCIK'], errors='coerce').to_numpy(dtype=float)
+    flows = pd.DataFrame({'Symbol': rows['Symbol'].to_numpy(), 'Date': date.to_numpy(), 'ReporterCIK': cik,
+                          'NetFlow': flow, 'WeightedFlow': flow * weight,
+                          'BuyValue': np.where(sell, 0.0, value), 'SellValue': np.where(sell, value, 0.0),
+                          'BuyShares': np.where(sell, 0.0, shares), 'SellShares': np.where(sell, shares, 0.0),
+                          'Buys': (~sell).astype(int), 'Sells': sell.astype(int),
+                          'OfficerCIK': np.where(officer, cik, np.nan), 'DirectorCIK': np.where(director, cik, np.nan)})
+    return flows[flows['Date'].notna() & flows['Symbol'].notna() & (flows['Symbol'] != '')]
+
+
+def aggregate(flows, freq='D'):
+    # sums and distinct insider counts per (Symbol, Date), Date being the day or, for freq 'W', the
+    # Monday of the week
+    flows = flows.assign(Date=get_period(flows['Date'], freq))
+    grouped = flows.groupby(['Symbol', 'Date'], sort=True)
+    result = grouped[list(SUMS)].sum()
+    result['Insiders'] = grouped['ReporterCIK'].nunique()
+    result['Officers'] = grouped['OfficerCIK'].nunique()
+    result['Directors'] = grouped['DirectorCIK'].nunique()
+    return result
+
+
+def get_period(dates, freq):
+    days = dates.dt.normalize()
+    if freq == 'W':
+        return days - pd.to_timedelta(days.dt.weekday, unit='D')
+    return days
+
+
+def get_rolling(daily, days=ROLLING_DAYS):
+    # trailing sums over days calendar days per symbol of a daily aggregate frame indexed by (Symbol, Date)
+    frame = daily[list(SUMS)].reset_index(level='Symbol')
+    rolled = frame.groupby('Symbol', sort=False)[list(SUMS)].rolling('%dD' % days).sum()
+    return rolled.rename(columns={name: 'Rolling' + name for name in SUMS})
+
+
+def load_daily(symbols=None, start=None):
+    # stored daily aggregates as a frame indexed by (Symbol, Date), e.g. to get_rolling over them
+    query = dict()
+    if symbols is not None:
+        query['Symbol'] = {'$in': list(symbols)}
+    if start is not None:
+        query['Date'] = {'$gte': start}
+    frame = pd.DataFrame(list(DevDB.find(DAILY, query)))
+    if frame.empty:
+        return pd.DataFrame(columns=list(SUMS), index=pd.MultiIndex.from_tuples([], names=['Symbol', 'Date']))
+    frame['Date'] = pd.to_datetime(frame['Date'])
+    return frame.drop(columns=['_id', 'UpdateTime']).set_index(['Symbol', 'Date']).sort_index()
+
+
+def to_records(aggregates):
+    # aggregate frame -> documents keyed by {Symbol, Date}
+    update_time = datetime.now()
+    frame = aggregates.reset_index()
+    frame['Date'] = frame['Date'].dt.strftime('%Y-%m-%d')
+    records = frame.to_dict('records')
+    for record in records:
+        record['UpdateTime'] = update_time
+        record['_id'] = {'Symbol': record['Symbol'], 'Date': record['Date']}
+    return records
+
+
+def write_aggregates(collection, aggregates):
+    # upsert recomputed aggregates, replacing the stored ones of the same symbol and period
+    ensure_index(collection, [('Symbol', 1), ('Date', 1)])
+    records = to_records(aggregates)
+    for start in range(0, len(records), WRITE_BATCH_SIZE):
+        requests = [ReplaceOne({'_id': record['_id']}, record, upsert=True)
+                    for record in records[start:start + WRITE_BATCH_SIZE]]
+        with METRICS.timer('write.' + collection):
+            DevDB.bulk_write(collection, requests, ordered=False)
+    METRICS.count(collection + '.upserted', len(records))
+    return len(records)
+
+
+def load_weeks(weeks):
+    # all insider rows of the touched weeks, {monday: symbols}, one query per week
+    ensure_index('MA_SEC_Form4', [('TransactionDate', 1), ('Symbol', 1)])
+    frames = list()
+    for monday, symbols in sorted(weeks.items()):
+        query = {'TransactionDate': {'$gte': monday.strftime('%Y-%m-%d'),
+                                     '$lt': (monday + timedelta(days=7)).strftime('%Y-%m-%d')},
+                 'Symbol': {'$in': sorted(symbols)}}
+        frames.append(to_frame(DevDB.find('MA_SEC_Form4', query, PROJECTION)))
+    return pd.concat(frames, ignore_index=True) if frames else to_frame([])
+
+
+def update(rebuild=False):
+    # recompute the daily and weekly aggregates of the symbol-days and weeks that have insider rows
+    # stored since the last update; untouched periods are neither read nor written
+    since, until = get_window(CHECKPOINT, rebuild)
+    query = {'$lt': until} if since is None else {'$gte': since, '$lt': until}
+    ensure_index('MA_SEC_Form4', [('UpdateTime', 1)])
+    with METRICS.timer('read.form4'):
+        changed = to_frame(DevDB.find('MA_SEC_Form4', {'UpdateTime': query}, PROJECTION))
+    with METRICS.timer('aggregate.flow'):
+        touched = get_flows(changed)
+        if since is None:
+            flows = touched # every row has changed, so there is nothing else to read
+        else:
+            weeks = dict()
+            for symbol, monday in zip(touched['Symbol'], get_period(touched['Date'], 'W')):
+                weeks.setdefault(monday, set()).add(symbol)
+            flows = get_flows(load_weeks(weeks))
+        days = pd.MultiIndex.from_frame(touched[['Symbol', 'Date']].assign(Date=get_period(touched['Date'], 'D')))
+        daily = aggregate(flows, 'D')
+        daily = daily[daily.index.isin(days)]
+        weekly = aggregate(flows, 'W')
+    n_daily = write_aggregates(DAILY, daily) if len(daily) else 0
+    n_weekly = write_aggregates(WEEKLY, weekly) if len(weekly) else 0
+    save_watermark(CHECKPOINT, until)
+    log.info('insider flow update', changed=len(changed), days=n_daily, weeks=n_weekly,
+             since=str(since), until=str(until))
+    return n_daily, n_weekly
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Aggregate insider net money flow per symbol.')
+    parser.add_argument('--rebuild', action='store_true', help='recompute every day and week')
+    args = parser.parse_args()
+    update(args.rebuild)
+
+
+if __name__ == '__main__':
+    main()
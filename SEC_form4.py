@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import io
+import json
+
+from lxml import etree
+
+from SEC_fetcher import get_content, get_page
+from SEC_metrics import log, METRICS
+
+PREFIX = 'https://www.sec.gov'
+FORM4_NAMES = ('doc4.xml', 'edgardoc.xml') # usual names of the raw ownershipDocument
+
+
+def value(elem, path):
+    # text of a form4 field, which is either a plain element or wrapped in <value>
+    text = elem.findtext(path + '/value')
+    if text is None:
+        text = elem.findtext(path)
+    return text.strip() if text else ''
+
+
+def to_int(text):
+    # share counts may be blank or footnote-only
+    try:
+        return int(float(text.replace(',', '')))
+    except ValueError:
+        return 0
+
+
+def to_float(text):
+    # prices may be blank or footnote-only
+    try:
+        return float(text.replace(',', ''))
+    except ValueError:
+        return 0
+
+
+def get_transaction(elem, line_number):
+    # fields shared by Table I and Table II rows
+    return {'Line': line_number,
+            'SecurityTitle': value(elem, 'securityTitle'),
+            'TransDate': value(elem, 'transactionDate')[:10],
+            'TransCode': value(elem, 'transactionCoding/transactionCode'),
+            'TransAmt': to_int(value(elem, 'transactionAmounts/transactionShares')),
+            'TransType': value(elem, 'transactionAmounts/transactionAcquiredDisposedCode'),
+            'Price': to_float(value(elem, 'transactionAmounts/transactionPricePerShare')),
+            'OwnedAmt': to_int(value(elem, 'postTransactionAmounts/sharesOwnedFollowingTransaction')),
+            'DirectIndirect': value(elem, 'ownershipNature/directOrIndirectOwnership')}
+
+
+def get_derivative(elem, line_number):
+    # Table II row: a transaction plus the derivative terms and underlying security
+    record = get_transaction(elem, line_number)
+    record.update({'ExercisePrice': to_float(value(elem, 'conversionOrExercisePrice')),
+                   'ExerciseDate': value(elem, 'exerciseDate')[:10],
+                   'ExpirationDate': value(elem, 'expirationDate')[:10],
+                   'UnderlyingTitle': value(elem, 'underlyingSecurity/underlyingSecurityTitle'),
+                   'UnderlyingAmt': to_int(value(elem, 'underlyingSecurity/underlyingSecurityShares'))})
+    return record
+
+
+def get_owner(elem):
+    # reporting owner with its relationship to the issuer, worded as on the own-disp page
+    relationship = list()
+    if value(elem, 'reportingOwnerRelationship/isDirector') in ('1', 'true'):
+        relationship.append('director')
+    if value(elem, 'reportingOwnerRelationship/isOfficer') in ('1', 'true'):
+        relationship.append('officer: ' + value(elem, 'reportingOwnerRelationship/officerTitle'))
+    if value(elem, 'reportingOwnerRelationship/isTenPercentOwner') in ('1', 'true'):
+        relationship.append('10 percent owner')
+    if value(elem, 'reportingOwnerRelationship/isOther') in ('1', 'true'):
+        relationship.append('other: ' + value(elem, 'reportingOwnerRelationship/otherText'))
+    return {'CIK': to_int(value(elem, 'reportingOwnerId/rptOwnerCik')),
+            'Name': value(elem, 'reportingOwnerId/rptOwnerName'),
+            'Relationship': ', '.join(relationship)}
+
+
+def parse_form4(content):
+    # stream a raw form4 ownershipDocument into issuer and owner info, Table I and Table II rows
+    result = {'Symbol': '', 'IssuerCIK': 0, 'IssuerName': '', 'FiledDate': '',
+              'Owners': list(), 'NonDerivative': list(), 'Derivative': list()}
+    for _, elem in etree.iterparse(io.BytesIO(content), events=('end',), recover=True):
+        tag = elem.tag
+        if tag == 'issuer':
+            result['Symbol'] = value(elem, 'issuerTradingSymbol').upper()
+            result['IssuerCIK'] = to_int(value(elem, 'issuerCik'))
+            result['IssuerName'] = value(elem, 'issuerName')
+        elif tag == 'reportingOwner':
+            result['Owners'].append(get_owner(elem))
+        elif tag == 'nonDerivativeTransaction':
+            rows = result['NonDerivative']
+            rows.append(get_transaction(elem, len(rows) + 1))
+        elif tag == 'derivativeTransaction':
+            rows = result['Derivative']
+            rows.append(get_derivative(elem, len(rows) + 1))
+        elif tag == 'signatureDate' and not result['FiledDate']:
+            result['FiledDate'] = (elem.text or '').strip()[:10]
+        else:
+            continue
+        elem.clear()
+    return result
+
+
+def form4_folder(form4_link):
+    # filing folder of a form4 index link, e.g. /Archives/edgar/data/<cik>/<accession>
+    return form4_link[::-1].split('/', 1)[1][::-1]
+
+
+def list_form4_names(folder):
+    # names of the xml documents in a filing folder, None if the folder cannot be listed
+    page = get_page(PREFIX + folder + '/index.json')
+    if page is None:
+        return None
+    try:
+        items = json.loads(page)['directory']['item']
+    except (ValueError, KeyError) as e:
+        log.warning('read filing index error', folder=folder, error=str(e))
+        return None
+    return [item['name'] for item in items if item['name'].endswith('.xml')]
+
+
+def form4_names(folder):
+    # candidate document names from the folder listing, which is cached for good like the filing, the
+    # usual names first; many filers name the document otherwise, and guessing costs a 404 each.
+    # Only the usual names are tried if the folder cannot be listed
+    names = list_form4_names(folder)
+    if names is None:
+        return list(FORM4_NAMES)
+    return sorted(names, key=lambda name: name not in FORM4_NAMES)
+
+
+def get_form4(form4_link):
+    # fetch and parse the raw ownershipDocument of a form4 filing, None if not found
+    folder = form4_folder(form4_link)
+    for name in form4_names(folder):
+        content = get_content(PREFIX + folder + '/' + name, 'ownershipDocument')
+        if content and b'ownershipDocument' in content:
+            with METRICS.timer('parse.form4'):
+                return parse_form4(content)
+    log.warning('form4 document not found', link=form4_link)
+    return None
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import gzip
+import re
+
+import requests
+
+from datetime import datetime
+from SEC_fetcher import get_user_agent, LIMITER, SESSION, HTTP_TIMEOUT
+from SEC_metrics import log, METRICS
+
+INDEX_URL = 'https://www.sec.gov/Archives/edgar/full-index/%d/QTR%d/%s.idx'
+DAILY_INDEX_URL = 'https://www.sec.gov/Archives/edgar/daily-index/%d/QTR%d/%s.%s.idx'
+FORM_WIDTH = 12 # width of the Form Type column of form.idx
+FORMS_4 = ('4', '4/A')
+FORMS_13F = ('13F-HR', '13F-HR/A')
+
+
+def quarter_url(year, quarter, kind='master'):
+    # url of a quarterly full index, kind is 'master' or 'form'
+    return INDEX_URL % (year, quarter, kind)
+
+
+def daily_url(date, kind='master'):
+    # url of the daily index of a datetime, kind is 'master' or 'form'
+    return DAILY_INDEX_URL % (date.year, (date.month - 1) // 3 + 1, kind, date.strftime('%Y%m%d'))
+
+
+def get_source(source):
+    # a source is a local index file (optionally .gz), an index url, a 'YYYYQn' quarter or a
+    # 'YYYYMMDD' day, whose daily index catches up on the filings since the last quarterly one
+    m = re.fullmatch(r'(\d{4})Q([1-4])', source)
+    if m:
+        return quarter_url(int(m.group(1)), int(m.group(2)))
+    if re.fullmatch(r'\d{8}', source):
+        return daily_url(datetime.strptime(source, '%Y%m%d'))
+    return source
+
+
+def read_lines(source):
+    # stream the lines of an index file without loading it into memory
+    source = get_source(source)
+    if source.startswith('http'):
+        get_user_agent()
+        LIMITER.acquire()
+        with SESSION.get(source, stream=True, timeout=HTTP_TIMEOUT) as r:
+            if r.status_code == 404:
+                # no daily index is published on weekends and holidays
+                log.warning('index not found', source=source)
+                return
+            r.raise_for_status()
+            for line in r.iter_lines():
+                yield line.decode('latin-1')
+        return
+    opener = gzip.open if source.endswith('.gz') else open
+    with opener(source, 'rb') as f:
+        for line in f:
+            yield line.decode('latin-1').rstrip('\r\n')
+
+
+def parse_index(lines):
+    # parse master.idx (pipe separated) or form.idx (fixed width) lines into filing dicts
+    started = False
+    for line in lines:
+        if not started:
+            started = line.startswith('-----')
+            continue
+        if not line.strip():
+            continue
+        if '|' in line:
+            fields = line.split('|')
+            if len(fields) != 5:
+                continue
+            cik, name, form_type, date_filed, file_name = fields
+        else:
+            fields = line.rsplit(None, 3)
+            if len(fields) != 4:
+                continue
+            left, cik, date_filed, file_name = fields
+            form_type = left[:FORM_WIDTH].strip()
+            name = left[FORM_WIDTH:].strip()
+        date_filed = date_filed.strip()
+        if len(date_filed) == 8:
+            date_filed = '%s-%s-%s' % (date_filed[:4], date_filed[4:6], date_filed[6:])
+        yield {'CIK': int(cik), 'CompanyName': name.strip(), 'FormType': form_type.strip(),
+               'DateFiled': date_filed, 'FileName': file_name.strip()}
+
+
+def filter_forms(filings, forms):
+    # keep the filings of the given form types
+    for filing in filings:
+        if filing['FormType'] in forms:
+            yield filing
+
+
+def unique_filings(filings):
+    # a filing is listed once per filer (issuer and each reporter); keep its first line only.
+    # The set holds accession numbers only, so memory grows with filings, not with the file.
+    seen = set()
+    for filing in filings:
+        accession = get_index_accession(filing)
+        if accession in seen:
+            continue
+        seen.add(accession)
+        yield filing
+
+
+def get_index_accession(filing):
+    # accession number, with dashes, of an index line, e.g. edgar/data/<cik>/<accession>.txt
+    return filing['FileName'].rsplit('/', 1)[1][:-4]
+
+
+def get_index_link(filing):
+    # filing index page link of an index line, the same form as the links on EDGAR listing pages
+    cik = filing['FileName'].split('/')[2]
+    accession = get_index_accession(filing)
+    return '/Archives/edgar/data/%s/%s/%s-index.htm' % (cik, accession.replace('-', ''), accession)
+
+
+def read_index(sources, forms):
+    # stream the unique filings of the given form types out of index sources; a source that cannot be
+    # read is logged and skipped rather than ending the backfill of the sources after it
+    for source in sources:
+        try:
+            yield from unique_filings(filter_forms(parse_index(read_lines(source)), forms))
+        except (requests.RequestException, OSError) as e:
+            METRICS.error('read.index')
+            log.error('read index error', source=source, error=str(e))
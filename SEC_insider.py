@@ -1,19 +1,19 @@
 #!/usr/bin/env python
 # coding: utf-8
 
-
-import requests
-from pymongo.errors import DuplicateKeyError, BulkWriteError
 from MongoDB.client import DevDB
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
 
-from bs4 import BeautifulSoup
 from datetime import datetime, timedelta
-from pytz import timezone
-from latest_user_agents import get_latest_user_agents
+from functools import partial
+from SEC_db import ensure_index, BatchWriter, Journal, CIKS
+from SEC_fetcher import get_html, get_page, get_accession, FetchError, FETCH_MODE, POOL
+from SEC_form4 import get_form4
+from SEC_index import read_index, get_index_link, FORMS_4
+from SEC_metrics import log, METRICS
+from SEC_pipeline import Stage, run_pipeline
+from SEC_tables import get_listing_rows, get_owner_tables
 
+import itertools
 import sys
 
 URL = 'https://www.sec.gov/cgi-bin/browse-edgar?company=&CIK=&type=4&owner=only&count=100&action=getcurrent'
@@ -21,308 +21,330 @@ NEXT_URL = 'https://www.sec.gov/cgi-bin/browse-edgar?action=getcurrent&datea=&da
 OWNER_URL = 'https://www.sec.gov/cgi-bin/own-disp?action=getowner&CIK='
 OWNER_URL_NEXT_PAGE = '&type=&dateb=&owner=include&start='
 PREFIX = 'https://www.sec.gov'
-
-
-def user_agent():
-    # get latest user agents
-    user_agents = get_latest_user_agents()
-    user_agent = ''
-    for i in user_agents:
-        if sys.platform == 'darwin' and ('Macintosh' in i):
-            user_agent = i
-        if sys.platform == 'linux' and ('Linux' in i) and ('Android' not in i):
-            user_agent = i
-    if not user_agent:
-        user_agent = user_agents[4]
-    return user_agent
-
-
-USER_AGENT = user_agent()
-
-
-def get_soup(url):
-    # create a chromedriver to access the page content
-    chrome_options = Options()
-    chrome_options.add_argument("--headless")
-    chrome_options.add_argument("start-maximized")
-    chrome_options.add_argument("disable-infobars")
-    chrome_options.add_argument("--disable-extensions")
-    chrome_options.add_argument("--window-size=1920x1080")
-    chrome_options.add_argument("--disable-dev-shm-usage")
-    chrome_options.add_argument("--no-sandbox")
-    chrome_options.add_argument("--user-agent=%s" % USER_AGENT)
-    service = Service('/usr/bin/chromedriver')
-    driver = webdriver.Chrome(options=chrome_options, service=service)
-    driver.get(url)
-    soup = BeautifulSoup(driver.page_source, 'html.parser')
-    driver.quit()
-    return soup
+FORM4_WRITER = BatchWriter('MA_SEC_Form4', [('Symbol', 1), ('IssuerCIK', 1), ('ReporterCIK', 1),
+                                            ('TransactionDate', 1), ('LineNumber', 1), ('FiledDate', 1)])
+LISTING_PAGES = 20 # scrape up to 20 pages each time
+MAX_AGE_DAYS = 500
+CHECKPOINT = 'Form4' # _id of the insider high-water mark in MA_SEC_Checkpoint
+SEEN_SLACK_DAYS = 30 # a form4 can be signed (FiledDate) well before it is accepted
+WORKERS = 4 # threads per network stage; the shared rate limiter caps the total request rate
+JOURNAL = Journal('Form4') # listing filings of the scheduled runs, see SEC_db.Journal
+BACKFILL_JOURNAL = Journal('Form4Backfill') # index filings of the backfills
+REPORT = 'report.sec_form4.json' # end-of-run metrics, see SEC_metrics.py
+BACKFILL_REPORT = 'report.sec_form4_backfill.json'
 
 
 def load_ciks():
-    # load the cik dictionary from MongoDB
-    cik_list = list(DevDB.find('MA_SEC_CIKList', {'Type': 'Issuer'}))
-    result = dict()
-    for cik in cik_list:
-        result[cik['CIK']] = cik['Symbol']
-    return result
+    # load the cik dictionary from MongoDB; symbols resolved later in the run are added to it
+    return CIKS.load()
 
 
-def get_symbol_form4(link, link_bak):
-    # get the trading ticker from form4 link
-    form4 = get_soup(PREFIX+link)
-    try:
-        symbol = form4.find(text='2. Issuer Name ').parent.next_sibling.next_sibling.next_sibling.next_sibling.text
-    except Exception as e:
-        try:
-            form4 = get_soup(PREFIX+link_bak)
-            symbol = form4.find(text='2. Issuer Name ').parent.next_sibling.next_sibling.next_sibling.next_sibling.text
-        except Exception as e:
-            print('Find symbol error: {}.'.format(e))
-            symbol = ''
-    return symbol.upper()
-
-
-def get_prices_form4(link, link_bak):
-    # get the trading info from form4 link
-    form4 = get_soup(PREFIX+link)
-    stock_table = form4.find(text='Table I - Non-Derivative Securities Acquired, Disposed of, or Beneficially Owned')
-    if stock_table == None:
-        form4 = get_soup(PREFIX+link_bak)
-        stock_table = form4.find(text='Table I - Non-Derivative Securities Acquired, Disposed of, or Beneficially Owned')
-        if stock_table == None:
-            return
-    tmp = stock_table.parent.parent.parent.parent.parent.tbody
-    if tmp == None:
-        return
-    rows = tmp.findAll('tr')
-    nrows = len(rows) # number of rows in Table I of Form-4
-    line = []
-    trans_date = []
-    trans_code = []# 'A' or 'S'
-    trans_amt = []
-    trans_type = []# 'A' or 'D'
-    price = []
-    owned_amt = []
-    filed_date = form4.find(text='Date').parent.parent.previous_sibling.previous_sibling.findAll('td')[-1].text
-    line_number = 0
-    for row in rows:
-        line_number += 1
-        cols = row.findAll('td')
-        t_code = cols[3].text.split('(')[0].replace('\n','')
-        t_type = cols[6].text.split('(')[0].replace('\n','')
-        if (t_code in 'ASPasp') and (t_type in 'ADad') and cols[1].text != '':
-            line.append(line_number)
-            trans_date.append(cols[1].text.split('(')[0])
-            trans_code.append(t_code)            
-            trans_amt_str = cols[5].text.replace(',', '').split('(')[0]
-            if trans_amt_str: 
-                t_amt = int(float(trans_amt_str))
-            else:
-                t_amt = 0
-            trans_amt.append(t_amt)
-            trans_type.append(cols[6].text.split('(')[0])
-            try:
-                p = float(row.find('span', attrs={'class': 'FormText'}).next_sibling.text.split('(')[0])
-            except Exception as e:
-                p = 0
-            price.append(p)
-            owned_amt_str = cols[8].text.replace(',', '').split('(')[0]
-            if owned_amt_str:
-                o_amt = int(float(owned_amt_str))
-            else:
-                o_amt = 0
-            owned_amt.append(o_amt)
-        else:
-            continue
-    return {'Line':line, 'TransDate':trans_date, 'TransCode':trans_code, 'TransAmt':trans_amt, 'TransType':trans_type, 'Price':price, 'OwnedAmt':owned_amt, 'FiledDate':filed_date}
+def get_prices_form4(form4):
+    # get the trading info of interest from the Table I rows of a parsed form4
+    result = list()
+    for row in form4['NonDerivative']:
+        t_code = row['TransCode']
+        t_type = row['TransType']
+        if (t_code in 'ASPasp') and (t_type in 'ADad') and row['TransDate'] != '':
+            result.append(row)
+    return result
 
 
 def update_cik_issuer(cik, name, symbol):
-    # Add new issuer cik info to database
-    DevDB.create_index('MA_SEC_CIKList', [('CIK', 1), ('Type', 1)])
-    if type(symbol) == list:
-        symbol = symbol[0]
-    try:
-        record = {'CIK': cik, 'CompanyName': name, 'Type': 'Issuer', 
-                  'Symbol': symbol, 'UpdateTime': datetime.now(), 
-                  '_id': {'CIK': cik, 'Type': 'Issuer'}}
-        DevDB.replace_one('MA_SEC_CIKList', {'_id': record['_id']}, record, upsert=True)
-        status = True
-    except Exception as e:
-        print('Insert/Update CIKList error: {}'.format(e))
-        status = False
-    return status
-
-
-def get_relationship_dict(soup):
-    # Get the relationship between reporter (insider) and issuer
-    table = soup.find('td', text='Filings').parent.parent
-    result = dict()
-    for row in table.findAll('tr')[1:]:
-        cols = row.findAll('td')
-        issuer_cik = int(cols[1].text)
-        name = cols[0].a.text
-        relationship = cols[3].text
-        result[issuer_cik] = [relationship, name]
-    return result
+    # Add new issuer cik info to the registry, written to database in batches
+    return CIKS.update(cik, name, 'Issuer', symbol)
 
 
-def get_owner_records(reporter_cik, cik_dict):
-    # Get the owner records from SEC insider transaction list
-    r = requests.get(OWNER_URL+str(reporter_cik), headers={'User-Agent': USER_AGENT})
-    soup = BeautifulSoup(r.content, 'html.parser')
-    relationship_dict = get_relationship_dict(soup)
-    table = soup.find('table', id='transaction-report')
-    if table == None:
-        return list()
-    result = list()
-    price_list = list()
-    filed_date = ''
-    for row in table.findAll('tr', attrs={'valign': 'top'})[1:]:
-        cols = row.findAll('td')
-        direction = cols[0].text
+def get_owner_entry(reporter_cik):
+    # Get the first form4 entry of a reporter from SEC insider transaction list
+    page = get_page(OWNER_URL+str(reporter_cik))
+    if page is None:
+        raise FetchError('cannot fetch ' + OWNER_URL + str(reporter_cik))
+    with METRICS.timer('parse.owner'):
+        tables = get_owner_tables(page)
+    if tables is None:
+        return None
+    relationship_dict, rows = tables
+    for cols, links in rows:
+        if len(cols) < 12:
+            continue
+        direction = cols[0]
         if direction not in 'AD':
             continue
         try:
-            issuer_cik = int(cols[10].text)
+            issuer_cik = int(cols[10])
         except Exception as e:
             continue
-        security = cols[11].text
-        if '4' in cols[4].text:
-            form4_link = cols[4].a['href']
+        security = cols[11]
+        if '4' in cols[4] and links[4]:
+            form4_link = links[4]
         else:
             continue
-        
-        detail_link = form4_link[::-1].split('/', 1)[1][::-1] + '/xslF345X03'
-        form4_detail_link = detail_link + '/doc4.xml'
-        form4_edgar_link = detail_link + '/edgardoc.xml'
-        print(form4_link)
-        print(form4_detail_link)        
-        if issuer_cik not in cik_dict:
-            symbol = get_symbol_form4(form4_detail_link, form4_edgar_link)
-            update_cik_issuer(issuer_cik, relationship_dict[issuer_cik][1], symbol)
-        elif cik_dict[issuer_cik] and (cik_dict[issuer_cik] != 'NONE'):
-            symbol = cik_dict[issuer_cik]
+        relationship, name = relationship_dict.get(issuer_cik, ['', ''])
+        # use the first entry to gain access to the form4, then take out all records of interest.
+        return {'ReporterCIK': reporter_cik, 'IssuerCIK': issuer_cik, 'IssuerName': name,
+                'Relationship': relationship, 'SecurityName': security, 'FormURL': form4_link,
+                'Direct/Indirect': cols[6], 'TableLine': int(cols[9])}
+    return None
+
+
+def get_form4_records(entry, cik_dict, form4=None):
+    # Get the Table I records of interest from the form4 of an owner entry, fetched unless already parsed
+    reporter_cik = entry['ReporterCIK']
+    issuer_cik = entry['IssuerCIK']
+    form4_link = entry['FormURL']
+    result = list()
+    log.debug('form4', link=form4_link)
+    known_symbol = issuer_cik in cik_dict and cik_dict[issuer_cik] and (cik_dict[issuer_cik] != 'NONE')
+    table_line_number = entry['TableLine']
+    # one raw xml read serves both the symbol lookup and Table I
+    if form4 is None and ((not known_symbol) or table_line_number >= 1):
+        form4 = get_form4(form4_link)
+    if known_symbol:
+        symbol = cik_dict[issuer_cik]
+    else:
+        symbol = form4['Symbol'] if form4 is not None else ''
+        update_cik_issuer(issuer_cik, entry['IssuerName'], symbol)
+    if table_line_number < 1 or form4 is None:
+        return result
+    filed_date = form4['FiledDate']
+    #generate multiple records based on the Table I rows
+    for row in get_prices_form4(form4):
+        if row['TransType'] == 'A':
+            buy_or_sell = 'P'
+            if row['TransCode'] == 'A':
+                trans_type = 'A-Award'
+            elif row['TransCode'] == 'P':
+                trans_type = 'P-Purchase'
+            else:
+                trans_type = 'Voluntary'
+        elif row['TransType'] == 'D':
+            buy_or_sell = 'S'
+            trans_type = 'S-Sale'
         else:
-            symbol = get_symbol_form4(form4_detail_link, form4_edgar_link)
-            update_cik_issuer(issuer_cik, relationship_dict[issuer_cik][1], symbol)
-        dir_indir = cols[6].text
-        table_line_number = int(cols[9].text)
-        if table_line_number >= 1:
-            tmp = get_prices_form4(form4_detail_link, form4_edgar_link)
-            if tmp is None:
-                return result
-            n = len(tmp['Price'])
-            line_list = tmp['Line']
-            trans_type_list = tmp['TransType']
-            trans_code_list = tmp['TransCode']
-            trans_date_list = tmp['TransDate']
-            trans_amt_list = tmp['TransAmt']
-            price_list = tmp['Price']
-            owned_amt_list = tmp['OwnedAmt']
-            filed_date_list = tmp['FiledDate'].split('/')
-            filed_date = '%s-%s-%s' % (filed_date_list[2], filed_date_list[0], filed_date_list[1])
-            #generate multiple records based on returned 'tmp'
-            for i in range(n):
-                if trans_type_list[i] == 'A':
-                    buy_or_sell = 'P'
-                    if trans_code_list[i] == 'A':
-                        trans_type = 'A-Award'
-                    elif trans_code_list[i] == 'P':
-                        trans_type = 'P-Purchase'
-                    else:
-                        trans_type = 'Voluntary'
-                elif trans_type_list[i] == 'D':
-                    buy_or_sell = 'S'
-                    trans_type = 'S-Sale'
-                else:
-                    buy_or_sell = '-'
-                    trans_type = '-'
-                date_str_list = trans_date_list[i].split('/')
-                date_str = '%s-%s-%s' % (date_str_list[2], date_str_list[0], date_str_list[1])
-                trans_amt = trans_amt_list[i]
-                owned_amt = owned_amt_list[i]
-                line_number = line_list[i]
-                price = price_list[i]
-                update_time = datetime.now()
-                record = {'Symbol': symbol, 'IssuerCIK': issuer_cik, 'ReporterCIK': reporter_cik,
-                         'Buy/Sell': buy_or_sell, 'TransactionDate': date_str, 'TransactionType': trans_type,
-                         'Direct/Indirect': dir_indir, 'TransactedAmt': trans_amt, 'OwnedAmt': owned_amt,
-                         'SecurityName': security, 'Relationship': relationship_dict[issuer_cik][0],
-                         'LineNumber': line_number, 'FormURL': form4_link, 'FiledDate': filed_date,
-                         'Price': price, 'UpdateTime': update_time,
-                         '_id': {'Symbol': symbol, 'IssuerCIK': issuer_cik, 'ReporterCIK': reporter_cik, 
-                                'TransactionDate': date_str, 'LineNumber': line_number, 'FiledDate': filed_date}}
-                result.append(record)
-        break # use the first entry to gain access to the form4, then take out all records of interest.
-    print(result)
-    print('No. of records: ', len(result))
+            buy_or_sell = '-'
+            trans_type = '-'
+        date_str = row['TransDate']
+        trans_amt = row['TransAmt']
+        owned_amt = row['OwnedAmt']
+        line_number = row['Line']
+        price = row['Price']
+        update_time = datetime.now()
+        record = {'Symbol': symbol, 'IssuerCIK': issuer_cik, 'ReporterCIK': reporter_cik,
+                 'Buy/Sell': buy_or_sell, 'TransactionDate': date_str, 'TransactionType': trans_type,
+                 'Direct/Indirect': entry['Direct/Indirect'], 'TransactedAmt': trans_amt, 'OwnedAmt': owned_amt,
+                 'SecurityName': entry['SecurityName'], 'Relationship': entry['Relationship'],
+                 'LineNumber': line_number, 'FormURL': form4_link, 'FiledDate': filed_date,
+                 'Price': price, 'UpdateTime': update_time,
+                 '_id': {'Symbol': symbol, 'IssuerCIK': issuer_cik, 'ReporterCIK': reporter_cik, 
+                        'TransactionDate': date_str, 'LineNumber': line_number, 'FiledDate': filed_date}}
+        result.append(record)
+    METRICS.count('filings')
+    METRICS.count('rows', len(result))
+    log.debug('form4 records', link=form4_link, count=len(result), records=result)
     return result
 
 
-def upload_form4(data):
-    # upload insider transaction results to database collection named MA_SEC_Form4
-    DevDB.create_index('MA_SEC_Form4', [('Symbol', 1), ('IssuerCIK', 1), ('ReporterCIK', 1), 
-                                        ('TransactionDate', 1), ('LineNumber', 1), ('FiledDate', 1)])
-    if data:
-        now = datetime.now(timezone('US/Eastern'))
-        dt_string = now.strftime("%y/%m/%d %H:%M:%S %Z%z")
-        try:
-            result = DevDB.insert_many('MA_SEC_Form4', data, ordered=False)
-            print('Inserted: %d' % (len(result.inserted_ids)))
-        except BulkWriteError as e:
-            print('Partial inserted: %d' % (len(data)-len(e.details['writeErrors'])))
-    return
+def update_cik_reporter(cik, name):
+    # Add new reporter info to the registry, written to database in batches
+    return CIKS.update(cik, name, 'Reporter')
 
 
-def update_cik_reporter(cik, name):
-    # Add new reporter info to database
-    DevDB.create_index('MA_SEC_CIKList', [('CIK', 1), ('Type', 1)])
+def load_checkpoint():
+    # load the newest filing seen by the last completed run
+    found = list(DevDB.find('MA_SEC_Checkpoint', {'_id': CHECKPOINT}))
+    return found[0] if found else None
+
+
+def save_checkpoint(mark):
+    # store the newest filing seen by this run as the high-water mark of the next one
     try:
-        record = {'CIK': cik, 'CompanyName': name, 'Type': 'Reporter', 
-                'UpdateTime': datetime.now(), '_id': {'CIK': cik, 'Type': 'Reporter'}}
-        DevDB.replace_one('MA_SEC_CIKList', {'_id': record['_id']}, record, upsert=True)
+        record = {'Accession': mark['Accession'], 'Accepted': mark['Accepted'],
+                  'UpdateTime': datetime.now(), '_id': CHECKPOINT}
+        DevDB.replace_one('MA_SEC_Checkpoint', {'_id': CHECKPOINT}, record, upsert=True)
         status = True
     except Exception as e:
-        print('Insert/Update CIKList error: {}'.format(e))
+        log.error('update checkpoint error', error=str(e))
         status = False
     return status
 
 
-cik_dict = load_ciks()
-# get SEC most recent Form4 reports from reporters
-
-table_list = list()
-soup = get_soup(URL)
-for i in range(20):#scrape up to 20 pages each time
-    table = soup.findAll('tr', attrs={'nowrap': 'nowrap'})
-    if not table:
-        # log_file.close()
-        break
-    table_list.append(table)
-    soup = get_soup(NEXT_URL % ((i+1)*100))
-for i in range(20):
-    table = table_list[i]
-    j = 0
-    for row in table:# each page has 100 rows
-        j += 1
-        columns = row.findAll('td')
-        if len(columns) < 6:
-            j -= 1
-            continue
-        cik = int(columns[1].a['href'].split('/')[4])
-        filed_date = columns[4].text
-        filed_dt = datetime.strptime(filed_date, '%Y-%m-%d')
-        print(columns[3].text, cik)
-        if datetime.now() - filed_dt > timedelta(days=500):
+def load_seen(since):
+    # (accession, reporter cik) pairs already in MA_SEC_Form4, filed since a 'YYYY-MM-DD' date
+    ensure_index('MA_SEC_Form4', [('FiledDate', 1)])
+    result = set()
+    for record in DevDB.find('MA_SEC_Form4', {'FiledDate': {'$gte': since}}, {'FormURL': 1, 'ReporterCIK': 1, '_id': 0}):
+        result.add((get_accession(record['FormURL']), record['ReporterCIK']))
+    return result
+
+
+def get_listing(pages=LISTING_PAGES, checkpoint=None, seen=None, mark=None):
+    # get SEC most recent Form4 reports from reporters, as (cik, reporter cik, reporter name, accession),
+    # stopping at the checkpoint and skipping filings in seen; the newest filing is put in mark
+    seen = set() if seen is None else seen
+    for i in range(pages):
+        page = get_html(URL if i == 0 else NEXT_URL % (i*100))
+        with METRICS.timer('parse.listing'):
+            rows = list(get_listing_rows(page))
+        if not rows:
             break
-        s = row.previous_sibling.previous_sibling.text
-        str_list = s.split('(0')
-        name_reporter = str_list[0][:-1].replace('\n', '')
-        cik_reporter = int(str_list[1].split(')')[0])
-        update_cik_reporter(cik_reporter, name_reporter)
-        upload_form4(get_owner_records(cik, cik_dict))
-        print('********** '+str(j)+' **********')
-    print('Page ' + str(i) + ' completed. ********************\n')
+        j = 0
+        for filer, columns, links in rows:# each page has 100 rows
+            j += 1
+            if len(columns) < 6:
+                j -= 1
+                continue
+            cik = int(links[1].split('/')[4])
+            accession = get_accession(links[1])
+            accepted = ''.join(ch for ch in columns[3] if ch.isdigit()) # YYYYMMDDHHMMSS
+            filed_date = columns[4]
+            filed_dt = datetime.strptime(filed_date, '%Y-%m-%d')
+            log.debug('listing row', accepted=columns[3], cik=cik)
+            if datetime.now() - filed_dt > timedelta(days=MAX_AGE_DAYS):
+                break
+            if mark is not None and not mark:
+                mark.update({'Accession': accession, 'Accepted': accepted})
+            if checkpoint and accepted < checkpoint['Accepted']:
+                log.info('reached checkpoint', accession=checkpoint['Accession'])
+                return
+            if (accession, cik) in seen:
+                continue
+            seen.add((accession, cik))
+            str_list = filer.split('(0')
+            name_reporter = str_list[0][:-1].replace('\n', '')
+            cik_reporter = int(str_list[1].split(')')[0])
+            yield cik, cik_reporter, name_reporter, accession
+            log.debug('listing filing', page=i, row=j)
+        METRICS.count('listing_pages')
+        log.info('listing page completed', page=i)
+
+
+def get_listing_key(item):
+    # journal key of a listing filing: accession and cik
+    return '%s:%d' % (item[3], item[0])
+
+
+def owner_stage(item):
+    # listing row -> first form4 entry of the reporter
+    cik, cik_reporter, name_reporter, accession = item
+    update_cik_reporter(cik_reporter, name_reporter)
+    return get_owner_entry(cik)
+
+
+def form4_stage(entry, cik_dict):
+    # form4 entry -> records of interest, dropping filings without any
+    form4 = get_form4(entry['FormURL'])
+    if form4 is None:
+        raise FetchError('cannot fetch form4 ' + entry['FormURL'])
+    return get_form4_records(entry, cik_dict, form4) or None
+
+
+def write_stage(item, journal):
+    # (journal key, records) -> records queued for MA_SEC_Form4; the filing is journaled as written
+    # once they are stored
+    key, data = item
+    FORM4_WRITER.add(data, partial(journal.written, key))
+    return len(data)
+
+
+def get_index_entry(form4_link, form4):
+    # owner entry of a form4 found in an EDGAR index, built from the filing itself
+    owner = form4['Owners'][0]
+    first = form4['NonDerivative'][0] if form4['NonDerivative'] else dict()
+    return {'ReporterCIK': owner['CIK'], 'IssuerCIK': form4['IssuerCIK'], 'IssuerName': form4['IssuerName'],
+            'Relationship': owner['Relationship'], 'SecurityName': first.get('SecurityTitle', ''),
+            'FormURL': form4_link, 'Direct/Indirect': first.get('DirectIndirect', ''),
+            'TableLine': len(form4['NonDerivative'])}
+
+
+def index_stage(filing, cik_dict):
+    # form4 index line -> records of interest
+    form4_link = get_index_link(filing)
+    form4 = get_form4(form4_link)
+    if form4 is None:
+        raise FetchError('cannot fetch form4 ' + form4_link)
+    if not form4['Owners']:
+        return None
+    entry = get_index_entry(form4_link, form4)
+    update_cik_reporter(entry['ReporterCIK'], form4['Owners'][0]['Name'])
+    return get_form4_records(entry, cik_dict, form4) or None
+
+
+def backfill(sources, workers=WORKERS):
+    # rebuild MA_SEC_Form4 from EDGAR form.idx/master.idx files (local paths, urls, 'YYYYQn' quarters or
+    # 'YYYYMMDD' days); filings journaled by an interrupted backfill are resumed rather than fetched again
+    cik_dict = load_ciks()
+    journal = BACKFILL_JOURNAL.load()
+    filings = journal.discover(read_index(sources, FORMS_4), get_index_link)
+    stages = [Stage('form4', journal.stage('parsed', partial(index_stage, cik_dict=cik_dict)), workers),
+              Stage('write', partial(write_stage, journal=journal), 1)]
+    summaries = run_pipeline(itertools.chain(journal.resumable(), filings), stages)
+    for summary in summaries:
+        log.info('pipeline stage', **summary)
+    CIKS.flush()
+    FORM4_WRITER.flush()
+    FORM4_WRITER.report()
+    journal.flush()
+    journal.report()
+    POOL.close()
+    METRICS.write_report(BACKFILL_REPORT, Job='Form4Backfill', Sources=list(sources), Pipeline=summaries,
+                         Writer=dict(FORM4_WRITER.counts), Journal=journal.summary())
+
+
+def load_state():
+    # warm state of the scheduled runs: the cik dictionary, the high-water mark, the filings stored since
+    # shortly before it and the journal; a long-running process keeps it across runs, see SEC_service.py
+    cik_dict = load_ciks()
+    checkpoint = load_checkpoint()
+    if checkpoint:
+        since = datetime.strptime(checkpoint['Accepted'][:8], '%Y%m%d') - timedelta(days=SEEN_SLACK_DAYS)
+    else:
+        since = datetime.now() - timedelta(days=MAX_AGE_DAYS+SEEN_SLACK_DAYS)
+    return {'cik_dict': cik_dict, 'checkpoint': checkpoint, 'seen': load_seen(since.strftime('%Y-%m-%d')),
+            'journal': JOURNAL.load()}
+
+
+def run(state, workers=WORKERS):
+    # one pass of the listing -> owner -> form4 -> database pipeline down to the high-water mark, with
+    # everything stored on return; unfinished filings of earlier passes are resumed first from the
+    # journal. Returns the sections of the run report
+    journal = state['journal']
+    resumed = journal.resumable()
+    log.info('resuming journaled filings', count=len(resumed))
+    mark = dict()
+    listing = journal.discover(get_listing(checkpoint=state['checkpoint'], seen=state['seen'], mark=mark),
+                               get_listing_key)
+    stages = [Stage('owner', journal.stage('fetched', owner_stage), workers),
+              Stage('form4', journal.stage('parsed', partial(form4_stage, cik_dict=state['cik_dict'])), workers),
+              Stage('write', partial(write_stage, journal=journal), 1)]
+    summaries = run_pipeline(itertools.chain(resumed, listing), stages)
+    for summary in summaries:
+        log.info('pipeline stage', **summary)
+    CIKS.flush()
+    FORM4_WRITER.flush()
+    # every filing down to the mark is in the journal now, so the high-water mark can move even if some
+    # of them failed: they are retried from the journal instead of the listing
+    if journal.flush() and mark:
+        save_checkpoint(mark)
+        state['checkpoint'] = mark
+    return {'Resumed': len(resumed), 'Checkpoint': mark, 'Pipeline': summaries}
+
+
+def main(workers=WORKERS):
+    # scrape the most recent Form4 reports once, e.g. from cron
+    state = load_state()
+    if FETCH_MODE == 'browser':
+        POOL.warm()
+    result = run(state, workers)
+    FORM4_WRITER.report()
+    state['journal'].report()
+    POOL.close()
+    METRICS.write_report(REPORT, Job='Form4', **result, Writer=dict(FORM4_WRITER.counts),
+                         Journal=state['journal'].summary())
+
 
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        backfill(sys.argv[1:])
+    else:
+        main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import contextlib
+import json
+import logging
+import threading
+import time
+
+import structlog
+
+from datetime import datetime
+
+LOG_LEVEL = 'info' # 'debug' adds per-row progress, including every record list
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000) # histogram upper bounds
+
+
+def configure_logging(level=LOG_LEVEL, file=None):
+    # key=value log lines on file (stdout by default); calls below level cost a no-op method call
+    structlog.configure(
+        processors=[structlog.processors.add_log_level,
+                    structlog.processors.TimeStamper(fmt='%Y-%m-%d %H:%M:%S'),
+                    structlog.processors.KeyValueRenderer(key_order=['timestamp', 'level', 'event'])],
+        wrapper_class=structlog.make_filtering_bound_logger(getattr(logging, level.upper())),
+        logger_factory=structlog.PrintLoggerFactory(file),
+        cache_logger_on_first_use=False)
+
+
+configure_logging()
+log = structlog.get_logger()
+
+
+class Metrics:
+    # latency histograms per stage and event counters, thread safe; stage names are prefixed by what
+    # they time: fetch.*, render.*, parse.*, write.* (database) and stage.* (pipeline stages)
+
+    def __init__(self):
+        self.started = datetime.now()
+        self.histograms = dict() # stage -> bucket counts, the last one for samples above BUCKETS_MS
+        self.totals = dict() # stage -> [count, sum of seconds, max seconds]
+        self.errors = dict()
+        self.counters = dict()
+        self.lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        ms = seconds * 1000
+        bucket = next((i for i, bound in enumerate(BUCKETS_MS) if ms <= bound), len(BUCKETS_MS))
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = [0] * (len(BUCKETS_MS) + 1)
+                self.totals[stage] = [0, 0.0, 0.0]
+            histogram[bucket] += 1
+            totals = self.totals[stage]
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] = max(totals[2], seconds)
+
+    def error(self, stage):
+        with self.lock:
+            self.errors[stage] = self.errors.get(stage, 0) + 1
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        # time a block as one sample of stage, counting an error if it raises
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.error(stage)
+            raise
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def percentile(self, histogram, n, q, max_ms):
+        # latency below which a q share of the samples fall, interpolated inside its bucket
+        rank = q * n
+        seen = 0
+        for i, count in enumerate(histogram):
+            if count and seen + count >= rank:
+                low = BUCKETS_MS[i - 1] if i > 0 else 0
+                high = BUCKETS_MS[i] if i < len(BUCKETS_MS) else max_ms
+                return min(max_ms, low + (high - low) * (rank - seen) / count)
+            seen += count
+        return max_ms
+
+    def summary(self):
+        # count, errors, mean, p50, p95, max in milliseconds and the non-empty histogram buckets per stage
+        result = dict()
+        with self.lock:
+            items = [(stage, list(self.histograms[stage]), list(self.totals[stage])) for stage in self.histograms]
+            errors = dict(self.errors)
+        for stage, histogram, (n, total, longest) in sorted(items):
+            max_ms = longest * 1000
+            buckets = dict()
+            for i, count in enumerate(histogram):
+                if count:
+                    buckets['<=%dms' % BUCKETS_MS[i] if i < len(BUCKETS_MS) else '>%dms' % BUCKETS_MS[-1]] = count
+            result[stage] = {'Count': n, 'Errors': errors.get(stage, 0),
+                             'MeanMs': round(total / n * 1000, 1),
+                             'P50Ms': round(self.percentile(histogram, n, 0.5, max_ms), 1),
+                             'P95Ms': round(self.percentile(histogram, n, 0.95, max_ms), 1),
+                             'MaxMs': round(max_ms, 1), 'Histogram': buckets}
+        for stage, n in errors.items():
+            result.setdefault(stage, {'Count': 0, 'Errors': n})
+        return result
+
+    def report(self, **extra):
+        # the run report: timing, counters, stage latencies and any extra sections
+        finished = datetime.now()
+        with self.lock:
+            counters = dict(sorted(self.counters.items()))
+        result = {'Started': self.started.strftime('%Y-%m-%d %H:%M:%S'),
+                  'Finished': finished.strftime('%Y-%m-%d %H:%M:%S'),
+                  'Seconds': round((finished - self.started).total_seconds(), 1),
+                  'Counters': counters, 'Stages': self.summary()}
+        result.update(extra)
+        return result
+
+    def write_report(self, path, **extra):
+        # write the run report as json to path
+        report = self.report(**extra)
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=1, default=str)
+            log.info('run report', path=path, seconds=report['Seconds'], counters=report['Counters'])
+        except OSError as e:
+            log.error('run report error', path=path, error=str(e))
+        return report
+
+
+METRICS = Metrics() # process-wide metrics shared by every module
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import queue
+import threading
+import time
+
+from SEC_metrics import log, METRICS
+
+QUEUE_SIZE = 50 # items waiting between two stages before the upstream stage blocks
+STOP = object()
+
+
+class Stage:
+    # one pipeline step: func(item) runs on worker threads and returns the item for the next stage,
+    # or None to drop it
+
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.done = 0
+        self.dropped = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def count(self, field):
+        with self.lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def summary(self):
+        return {'Stage': self.name, 'Workers': self.workers, 'Done': self.done,
+                'Dropped': self.dropped, 'Errors': self.errors}
+
+
+def run_stage(stage, inbox, outbox, remaining):
+    # worker loop: the last worker of a stage to stop passes STOP downstream
+    while True:
+        item = inbox.get()
+        if item is STOP:
+            with remaining['lock']:
+                remaining['n'] -= 1
+                last = remaining['n'] == 0
+            if last and outbox is not None:
+                outbox.put(STOP)
+            else:
+                inbox.put(STOP)
+            return
+        start = time.perf_counter()
+        try:
+            result = stage.func(item)
+        except Exception as e:
+            stage.count('errors')
+            METRICS.error('stage.' + stage.name)
+            log.warning('pipeline stage error', stage=stage.name, error=str(e))
+            continue
+        finally:
+            METRICS.record('stage.' + stage.name, time.perf_counter() - start)
+        if result is None:
+            stage.count('dropped')
+            continue
+        stage.count('done')
+        if outbox is not None:
+            outbox.put(result)
+
+
+def run_pipeline(source, stages, queue_size=QUEUE_SIZE):
+    # feed the items of source through the stages over bounded queues, blocking the source when full
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    threads = list()
+    for n, stage in enumerate(stages):
+        outbox = queues[n + 1] if n + 1 < len(stages) else None
+        remaining = {'n': stage.workers, 'lock': threading.Lock()}
+        for w in range(stage.workers):
+            thread = threading.Thread(target=run_stage, name='%s-%d' % (stage.name, w),
+                                      args=(stage, queues[n], outbox, remaining), daemon=True)
+            thread.start()
+            threads.append(thread)
+    try:
+        for item in source:
+            queues[0].put(item)
+    finally:
+        queues[0].put(STOP)
+        for thread in threads:
+            thread.join()
+    return [stage.summary() for stage in stages]
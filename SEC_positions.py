@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Quarter-over-quarter 13F position changes of every institution, derived from MA_SEC_13F:
+#   python SEC_positions.py             recompute the periods of the filings stored since the last update
+#   python SEC_positions.py --rebuild   recompute every institution
+# MA_SEC_13FChanges holds one document per position (CIK, Period, CUSIP, AMTType) comparing it with the
+# institution's previous reported period as new, increased, decreased, unchanged or exited;
+# get_cusip_changes sums a period's changes per CUSIP across institutions.
+
+import argparse
+
+import numpy as np
+import pandas as pd
+from pymongo import DeleteOne, ReplaceOne
+from MongoDB.client import DevDB
+
+from datetime import datetime
+from SEC_db import ensure_index, get_window, save_watermark
+from SEC_metrics import log, METRICS
+
+CHANGES = 'MA_SEC_13FChanges'
+CHECKPOINT = 'Positions.13F' # _id of the update watermark in MA_SEC_Checkpoint
+CIK_BATCH = 200 # institutions loaded and diffed at once
+WRITE_BATCH_SIZE = 1000
+KEY = ['CIK', 'Period', 'CUSIP', 'AMTType'] # one position; shares, principal, puts and calls of a CUSIP are apart
+FIELDS = ('CIK', 'FiledDate', 'Period', 'FormType', 'CUSIP', 'Name', 'AMTType', 'Value', 'Amount', 'FormURL')
+FILING_FIELDS = {'CIK': 1, 'Period': 1, 'FiledDate': 1, 'FormURL': 1, '_id': 0} # projection naming a row's filing
+CHANGE_TYPES = ('new', 'increased', 'decreased', 'unchanged', 'exited')
+SUMS = ('Shares', 'PrevShares', 'ShareChange', 'Value', 'PrevValue', 'ValueChange')
+
+
+def to_frame(documents):
+    # MA_SEC_13F documents -> data frame of the FIELDS columns
+    columns = {name: list() for name in FIELDS}
+    for document in documents:
+        for name in FIELDS:
+            columns[name].append(document.get(name))
+    return pd.DataFrame(columns)
+
+
+def get_report_period(rows):
+    # period of report of each holdings row; rows stored before it was recorded get the quarter end
+    # before their filed date, as a 13F is due within 45 days of its quarter end
+    filed = pd.to_datetime(rows['FiledDate'], errors='coerce')
+    fallback = (filed.dt.to_period('Q') - 1).dt.end_time.dt.normalize()
+    return pd.to_datetime(rows['Period'], errors='coerce').fillna(fallback)
+
+
+def get_positions(rows):
+    # holdings summed per position at each period end, indexed by KEY. Per institution and period the
+    # latest 13F-HR is the base, dropping the rows of any earlier one, and each later 13F-HR/A
+    # supersedes the base rows of the positions it reports
+    rows = rows.assign(Period=get_report_period(rows), CUSIP=rows['CUSIP'].fillna(''),
+                       AMTType=rows['AMTType'].fillna(''), FormURL=rows['FormURL'].fillna(''),
+                       Amount=pd.to_numeric(rows['Amount'], errors='coerce').fillna(0),
+                       Value=pd.to_numeric(rows['Value'], errors='coerce').fillna(0))
+    rows = rows[rows['Period'].notna()].sort_values(['FiledDate', 'FormURL'], kind='stable')
+    if rows.empty:
+        # e.g. institutions indexed only with 13F-NT filings, which hold no rows
+        index = pd.MultiIndex.from_arrays([pd.Index([], dtype=object), pd.DatetimeIndex([]),
+                                           pd.Index([], dtype=object), pd.Index([], dtype=object)], names=KEY)
+        return pd.DataFrame({'Shares': [], 'Value': [], 'Name': [], 'FormURL': []}, index=index)
+    rows['Filing'] = pd.factorize(rows['FiledDate'].astype(str) + '|' + rows['FormURL'])[0] # in filing order
+    amendment = rows['FormType'].fillna('').astype(str).str.endswith('/A')
+    base = rows['Filing'].where(~amendment).groupby([rows['CIK'], rows['Period']]).transform('max')
+    rows = rows[base.isna() | (rows['Filing'] >= base)]
+    rows = rows[rows['Filing'] == rows.groupby(KEY)['Filing'].transform('max')]
+    return rows.groupby(KEY, sort=True).agg(Shares=('Amount', 'sum'), Value=('Value', 'sum'),
+                                            Name=('Name', 'first'), FormURL=('FormURL', 'first'))
+
+
+def get_changes(positions):
+    # compare every position with the institution's previous reported period: the positions of each
+    # period are moved forward onto the next period and outer joined on KEY with the positions there.
+    # The first period of an institution has nothing to compare with and is left out
+    periods = positions.index.droplevel(['CUSIP', 'AMTType']).unique().to_frame(index=False)
+    periods = periods.sort_values(['CIK', 'Period'])
+    periods['PrevPeriod'] = periods.groupby('CIK')['Period'].shift(1)
+    periods['NextPeriod'] = periods.groupby('CIK')['Period'].shift(-1)
+    frame = positions.reset_index()
+    current = frame.merge(periods[['CIK', 'Period', 'PrevPeriod']], on=['CIK', 'Period'])
+    current = current[current['PrevPeriod'].notna()]
+    previous = frame.merge(periods[['CIK', 'Period', 'NextPeriod']], on=['CIK', 'Period'])
+    previous = previous[previous['NextPeriod'].notna()]
+    previous = previous.rename(columns={'Period': 'PrevPeriod', 'NextPeriod': 'Period', 'Shares': 'PrevShares',
+                                        'Value': 'PrevValue', 'Name': 'PrevName', 'FormURL': 'PrevFormURL'})
+    changes = current.merge(previous, on=KEY + ['PrevPeriod'], how='outer')
+    held = changes['Shares'].notna().to_numpy()
+    before = changes['PrevShares'].notna().to_numpy()
+    shares = changes['Shares'].fillna(0).to_numpy(dtype=float)
+    prev_shares = changes['PrevShares'].fillna(0).to_numpy(dtype=float)
+    changes['Change'] = np.select([~before, ~held, shares > prev_shares, shares < prev_shares],
+                                  ['new', 'exited', 'increased', 'decreased'], 'unchanged')
+    for name in ('Shares', 'PrevShares', 'Value', 'PrevValue'):
+        changes[name] = changes[name].fillna(0)
+    changes['ShareChange'] = changes['Shares'] - changes['PrevShares']
+    changes['ValueChange'] = changes['Value'] - changes['PrevValue']
+    changes['Name'] = changes['Name'].fillna(changes['PrevName'])
+    changes['FormURL'] = changes['FormURL'].fillna(changes['PrevFormURL'])
+    return changes.drop(columns=['PrevName', 'PrevFormURL'])
+
+
+def aggregate_cusips(changes):
+    # per (Period, CUSIP, AMTType) totals of institution changes, with the holders before and after
+    # and the number of institutions of each change type
+    flags = {name.title(): (changes['Change'] == name).astype(int) for name in CHANGE_TYPES}
+    frame = changes.assign(Holders=(changes['Shares'] > 0).astype(int),
+                           PrevHolders=(changes['PrevShares'] > 0).astype(int), **flags)
+    columns = list(SUMS) + ['Holders', 'PrevHolders'] + list(flags)
+    return frame.groupby(['Period', 'CUSIP', 'AMTType'], sort=True)[columns].sum()
+
+
+def get_cusip_changes(period, cusips=None):
+    # stored institution changes of a period ('YYYY-MM-DD' quarter end) summed per CUSIP
+    ensure_index(CHANGES, [('Period', 1), ('CUSIP', 1)])
+    query = {'Period': period}
+    if cusips is not None:
+        query['CUSIP'] = {'$in': list(cusips)}
+    changes = pd.DataFrame(list(DevDB.find(CHANGES, query)))
+    if changes.empty:
+        return changes
+    return aggregate_cusips(changes)
+
+
+def to_records(changes):
+    # change frame -> documents keyed by KEY
+    update_time = datetime.now()
+    frame = changes.copy()
+    for name in ('Period', 'PrevPeriod'):
+        frame[name] = frame[name].dt.strftime('%Y-%m-%d')
+    for name in ('Shares', 'PrevShares', 'ShareChange'):
+        frame[name] = frame[name].astype('int64')
+    records = frame.to_dict('records')
+    for record in records:
+        record['UpdateTime'] = update_time
+        record['_id'] = {name: record[name] for name in KEY}
+    return records
+
+
+def write_changes(ciks, changes, periods=None):
+    # replace the stored changes of the institutions in ciks, only of the (CIK, 'YYYY-MM-DD' period)
+    # pairs in periods if given; stored positions no longer in changes are deleted
+    ensure_index(CHANGES, [('CIK', 1), ('Period', 1)])
+    records = to_records(changes)
+    ids = {str(record['_id']) for record in records}
+    requests = [ReplaceOne({'_id': record['_id']}, record, upsert=True) for record in records]
+    query = {'CIK': {'$in': list(ciks)}}
+    if periods is not None:
+        query['Period'] = {'$in': sorted({period for cik, period in periods})}
+    for stored in DevDB.find(CHANGES, query, {'CIK': 1, 'Period': 1}):
+        pair = (stored['CIK'], stored['Period'])
+        if (periods is None or pair in periods) and str(stored['_id']) not in ids:
+            requests.append(DeleteOne({'_id': stored['_id']}))
+    for start in range(0, len(requests), WRITE_BATCH_SIZE):
+        with METRICS.timer('write.' + CHANGES):
+            DevDB.bulk_write(CHANGES, requests[start:start + WRITE_BATCH_SIZE], ordered=False)
+    METRICS.count(CHANGES + '.upserted', len(records))
+    METRICS.count(CHANGES + '.deleted', len(requests) - len(records))
+    return len(records)
+
+
+def get_filings(ciks):
+    # (CIK, FormURL, 'YYYY-MM-DD' Period) of every 13F filing of the institutions, read off the
+    # (CIK, Period, FiledDate, FormURL) index without fetching the holdings
+    ensure_index('MA_SEC_13F', [('CIK', 1), ('Period', 1), ('FiledDate', 1), ('FormURL', 1)])
+    rows = pd.DataFrame(list(DevDB.find('MA_SEC_13F', {'CIK': {'$in': list(ciks)}}, FILING_FIELDS)),
+                        columns=['CIK', 'Period', 'FiledDate', 'FormURL'])
+    rows['Period'] = get_report_period(rows).dt.strftime('%Y-%m-%d')
+    return rows[rows['Period'].notna()].drop_duplicates(['CIK', 'FormURL', 'Period'])
+
+
+def get_neighbours(filings, touched):
+    # (CIK, period) pairs to read for the touched pairs: each with the institution's previous and next
+    # reported periods, and the pairs whose changes are rewritten: each touched one and its next period
+    periods = filings[['CIK', 'Period']].drop_duplicates().sort_values(['CIK', 'Period'])
+    periods['PrevPeriod'] = periods.groupby('CIK')['Period'].shift(1)
+    periods['NextPeriod'] = periods.groupby('CIK')['Period'].shift(-1)
+    periods = periods[pd.MultiIndex.from_frame(periods[['CIK', 'Period']]).isin(list(touched))]
+    rewrite = set(touched) | {(cik, period) for cik, period in zip(periods['CIK'], periods['NextPeriod'])
+                              if isinstance(period, str)}
+    read = rewrite | {(cik, period) for cik, period in zip(periods['CIK'], periods['PrevPeriod'])
+                      if isinstance(period, str)}
+    return read, rewrite
+
+
+def read_rows(ciks, touched=None):
+    # holdings rows of the institutions, or, given touched pairs, only the filings of those pairs and of
+    # the periods around them; returns the rows and the (CIK, period) pairs whose changes they settle
+    ensure_index('MA_SEC_13F', [('FormURL', 1)])
+    if touched is None:
+        return to_frame(DevDB.find('MA_SEC_13F', {'CIK': {'$in': list(ciks)}})), None
+    filings = get_filings(ciks)
+    read, rewrite = get_neighbours(filings, touched)
+    pairs = pd.MultiIndex.from_frame(filings[['CIK', 'Period']]).isin(list(read))
+    urls = sorted(filings.loc[pairs, 'FormURL'].dropna().unique())
+    return to_frame(DevDB.find('MA_SEC_13F', {'FormURL': {'$in': urls}})), rewrite
+
+
+def update(rebuild=False):
+    # diff the institutions with holdings stored since the last update, reading and rewriting only the
+    # periods of the new filings and the periods following them; an amendment of an old period thus
+    # also refreshes the comparison of the period after it
+    since, until = get_window(CHECKPOINT, rebuild)
+    if since is None:
+        ciks = sorted({record['CIK'] for record in DevDB.find('MA_SEC_13FIndex', {})})
+        touched = None
+    else:
+        ensure_index('MA_SEC_13F', [('UpdateTime', 1)])
+        changed = to_frame(DevDB.find('MA_SEC_13F', {'UpdateTime': {'$gte': since, '$lt': until}}, FILING_FIELDS))
+        periods = get_report_period(changed).dt.strftime('%Y-%m-%d')
+        touched = set(zip(changed['CIK'], periods))
+        ciks = sorted({cik for cik, period in touched})
+    written = 0
+    for start in range(0, len(ciks), CIK_BATCH):
+        batch = ciks[start:start + CIK_BATCH]
+        pairs = None if touched is None else {(cik, period) for cik, period in touched if cik in batch}
+        with METRICS.timer('read.13F'):
+            rows, rewrite = read_rows(batch, pairs)
+        with METRICS.timer('aggregate.positions'):
+            changes = get_changes(get_positions(rows))
+            if rewrite is not None:
+                rewritten = pd.MultiIndex.from_arrays([changes['CIK'], changes['Period'].dt.strftime('%Y-%m-%d')])
+                changes = changes[rewritten.isin(list(rewrite))]
+        written += write_changes(batch, changes, rewrite)
+    save_watermark(CHECKPOINT, until)
+    log.info('13F position changes', institutions=len(ciks), positions=written, since=str(since), until=str(until))
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Diff the 13F positions of each institution quarter over quarter.')
+    parser.add_argument('--rebuild', action='store_true', help='recompute every institution')
+    args = parser.parse_args()
+    update(args.rebuild)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import atexit
+import hashlib
+import json
+import os
+import threading
+
+import requests
+
+import SEC_fetcher
+
+MANIFEST = 'manifest.json'
+
+
+class Corpus:
+    # fixture corpus of captured SEC pages: <path>/manifest.json maps each url to a file under
+    # <path>/pages holding the page exactly as served, so fixtures can be read and edited by hand
+
+    def __init__(self, path):
+        self.path = path
+        self.pages = dict() # url -> file name relative to path
+        self.lock = threading.Lock()
+        manifest = os.path.join(path, MANIFEST)
+        if os.path.exists(manifest):
+            with open(manifest, 'r', encoding='utf-8') as f:
+                self.pages = json.load(f)
+
+    def urls(self):
+        return list(self.pages)
+
+    def add(self, url, content):
+        # capture a page
+        name = 'pages/%s%s' % (hashlib.sha256(url.encode('utf-8')).hexdigest()[:20], get_suffix(url))
+        os.makedirs(os.path.join(self.path, 'pages'), exist_ok=True)
+        with open(os.path.join(self.path, name), 'wb') as f:
+            f.write(content)
+        with self.lock:
+            self.pages[url] = name
+
+    def save(self):
+        with self.lock:
+            pages = dict(self.pages)
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, MANIFEST), 'w', encoding='utf-8') as f:
+            json.dump(pages, f, indent=1, sort_keys=True)
+
+    def read(self, url):
+        # captured page content, None if the url is not in the corpus
+        name = self.pages.get(url)
+        if name is None:
+            return None
+        with open(os.path.join(self.path, name), 'rb') as f:
+            return f.read()
+
+    def response(self, url):
+        # the captured page as a 200 response, or a 404 like SEC for pages not in the corpus
+        content = self.read(url)
+        r = requests.Response()
+        r.url = url
+        r.status_code = 200 if content is not None else 404
+        r._content = content if content is not None else b''
+        r.encoding = 'utf-8'
+        return r
+
+
+def get_suffix(url):
+    path = url.split('?')[0]
+    for suffix in ('.xml', '.json', '.htm', '.html', '.txt'):
+        if path.endswith(suffix):
+            return suffix
+    return '.html'
+
+
+def replay(path):
+    # serve every fetch from a corpus: no network, no Chrome, no rate limit
+    corpus = Corpus(path)
+    SEC_fetcher.REPLAY = corpus
+    return corpus
+
+
+def record(path):
+    # capture every page fetched from SEC into a corpus, saved at exit
+    corpus = Corpus(path)
+    SEC_fetcher.RECORD = corpus
+    atexit.register(corpus.save)
+    return corpus
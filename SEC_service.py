@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Long-running ingest service replacing the cron runs of SEC_insider.py and SEC_Institution.py:
+#   python SEC_service.py [form4] [13F]
+# Setup happens once; each feed then polls its EDGAR getcurrent listing on its own thread and ingests the
+# new filings within a poll interval, keeping the cik registry, journal, seen filings, http session and
+# chromedrivers warm between polls. SIGINT or SIGTERM stop it after the polls in flight.
+
+import argparse
+import signal
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+from pytz import timezone
+
+import SEC_insider
+import SEC_Institution
+from SEC_fetcher import get_user_agent, FETCH_MODE, POOL
+from SEC_metrics import log, METRICS
+
+EASTERN = timezone('US/Eastern')
+BUSINESS_HOURS = (6, 22) # EDGAR accepts filings 6:00-22:00 Eastern on weekdays
+POLL_BUSY = 30 # seconds between polls of a feed while EDGAR accepts filings
+POLL_IDLE = 900 # seconds between polls at other times, which only bring filings disseminated late
+REPORT = 'report.sec_service.json' # service metrics, rewritten every REPORT_INTERVAL seconds and on exit
+REPORT_INTERVAL = 600
+FEEDS = ('form4', '13F')
+
+
+def is_open(now):
+    # whether EDGAR accepts filings at Eastern time now
+    return now.weekday() < 5 and BUSINESS_HOURS[0] <= now.hour < BUSINESS_HOURS[1]
+
+
+def get_interval(now):
+    # seconds from Eastern time now to the next poll: POLL_BUSY during business hours, otherwise
+    # POLL_IDLE but never past the next opening
+    if is_open(now):
+        return POLL_BUSY
+    opening = now.replace(hour=BUSINESS_HOURS[0], minute=0, second=0, microsecond=0)
+    while opening <= now or opening.weekday() >= 5:
+        opening += timedelta(days=1)
+    return min(POLL_IDLE, (opening - now).total_seconds())
+
+
+class Feed:
+    # one polled filing feed: load() builds the warm state of the job and poll(state) ingests what is
+    # new; the state is built again on the first poll of each Eastern day, which also prunes it
+
+    def __init__(self, name, load, poll):
+        self.name = name
+        self.load = load
+        self.poll = poll
+        self.polls = 0
+        self.errors = 0
+        self.last = None # report sections of the last poll
+
+    def loop(self, stop):
+        state = day = None
+        while not stop.is_set():
+            now = datetime.now(EASTERN)
+            start = time.monotonic()
+            try:
+                if state is None or now.date() != day:
+                    state, day = self.load(), now.date()
+                    log.info('feed state loaded', feed=self.name)
+                with METRICS.timer('poll.' + self.name):
+                    self.last = self.poll(state)
+                self.polls += 1
+            except Exception as e:
+                self.errors += 1
+                log.error('poll error', feed=self.name, error=str(e))
+            stop.wait(max(0, get_interval(now) - (time.monotonic() - start)))
+
+    def summary(self):
+        return {'Polls': self.polls, 'Errors': self.errors, 'Last': self.last}
+
+
+def get_feeds(names, filings, institutions):
+    feeds = {'form4': Feed('form4', SEC_insider.load_state, SEC_insider.run),
+             '13F': Feed('13F', SEC_Institution.load_state,
+                         partial(SEC_Institution.run, filings=filings, institutions=institutions))}
+    return [feeds[name] for name in names]
+
+
+def write_report(feeds):
+    METRICS.write_report(REPORT, Job='Service', Feeds={feed.name: feed.summary() for feed in feeds},
+                         Writers={'MA_SEC_Form4': dict(SEC_insider.FORM4_WRITER.counts),
+                                  'MA_SEC_13F': dict(SEC_Institution.WRITER_13F.counts)})
+
+
+def serve(names, stop):
+    # run the feeds until stop is set; the shared setup happens here once
+    get_user_agent()
+    if FETCH_MODE == 'browser':
+        POOL.warm()
+    with ThreadPoolExecutor(SEC_Institution.FILING_WORKERS) as filings, \
+            ThreadPoolExecutor(SEC_Institution.WORKERS) as institutions:
+        feeds = get_feeds(names, filings, institutions)
+        threads = [threading.Thread(target=feed.loop, args=(stop,), name=feed.name) for feed in feeds]
+        for thread in threads:
+            thread.start()
+        log.info('service started', feeds=names)
+        while not stop.wait(REPORT_INTERVAL):
+            write_report(feeds)
+        for thread in threads:
+            thread.join()
+    POOL.close()
+    write_report(feeds)
+    log.info('service stopped')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Poll the EDGAR filing feeds and ingest new filings as they appear.')
+    parser.add_argument('feeds', nargs='*', help='feeds to poll, form4 and/or 13F (default: both)')
+    args = parser.parse_args()
+    for name in args.feeds:
+        if name not in FEEDS:
+            parser.error('unknown feed %s (choose from %s)' % (name, ', '.join(FEEDS)))
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+    serve(args.feeds or list(FEEDS), stop)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import io
+
+import lxml.etree
+import lxml.html
+
+HTML_PARSER = lxml.html.HTMLParser(encoding='utf-8')
+INFO_TABLE = 'Form 13F-NT Header Information' # summary of the holdings table of a rendered 13F information table
+FILE_TABLE = 'Document Format Files' # summary of the document table of a filing index page
+FORM_NAME = 'id="formName"' # heading of a filing index page, '<strong>Form 13F-HR</strong> - ...'
+PERIOD_HEAD = 'Period of Report' # infoHead label of the period on a filing index page
+
+
+def get_region(page, marker, tag='table'):
+    # the html of the innermost tag element around the first occurrence of marker, so only that
+    # subtree gets parsed; the whole page if the marker or the element is not found
+    lowered = page.lower()
+    i = lowered.find(marker.lower())
+    if i < 0:
+        return page
+    start = lowered.rfind('<' + tag, 0, i)
+    end = lowered.find('</%s>' % tag, i)
+    if start < 0 or end < 0:
+        return page
+    return page[start:end + len(tag) + 3]
+
+
+def parse_html(page, marker=None):
+    # lxml tree of a page, or only of the table around marker; None for an empty page
+    if marker is not None:
+        page = get_region(page, marker)
+    if not page or not page.strip():
+        return None
+    return lxml.html.fromstring(page.encode('utf-8'), parser=HTML_PARSER)
+
+
+def get_href(element):
+    # href of the first link in an element, None without one
+    links = element.xpath('.//a[@href]')
+    return links[0].get('href') if links else None
+
+
+def get_row(tr):
+    # a table row as (cell texts, first href of each cell)
+    tds = tr.findall('td')
+    return tuple(td.text_content() for td in tds), tuple(get_href(td) for td in tds)
+
+
+def get_listing_rows(page):
+    # rows of a getcurrent listing as (filer, cell texts, cell hrefs); filer is the text of the
+    # heading row naming the filer, e.g. 'NAME (0001234567) (Reporting)'
+    root = parse_html(page)
+    if root is None:
+        return
+    for tr in root.xpath('//tr[@nowrap="nowrap"]'):
+        heading = tr.getprevious()
+        filer = heading.text_content() if heading is not None else ''
+        cells, links = get_row(tr)
+        yield filer, cells, links
+
+
+def get_owner_tables(page):
+    # the issuer table of an own-disp page as {issuer cik: [relationship, issuer name]} and the rows
+    # of its transaction-report table as (cell texts, cell hrefs); None for a page without the report
+    root = parse_html(page)
+    if root is None:
+        return None
+    relationships = dict()
+    for table in root.xpath('//td[normalize-space()="Filings"]/ancestor::table[1]')[:1]:
+        for tr in table.xpath('.//tr')[1:]:
+            cells = tuple(td.text_content() for td in tr.findall('td'))
+            try:
+                relationships[int(cells[1])] = [cells[3], cells[0]]
+            except (IndexError, ValueError):
+                continue
+    tables = root.xpath('//table[@id="transaction-report"]')
+    if not tables:
+        return None
+    rows = [get_row(tr) for tr in tables[0].xpath('.//tr[@valign="top"]')[1:]]
+    return relationships, rows
+
+
+def get_filing_history(page, limit=None):
+    # (document link, filed date) of the filings in a getcompany filing history, newest first
+    root = parse_html(page)
+    result = list()
+    if root is None:
+        return result
+    for document in root.xpath('//a[@id="documentsbutton"]'):
+        if limit is not None and len(result) >= limit:
+            break
+        td = document.getparent()
+        for _ in range(2):
+            td = td.getnext() if td is not None else None
+        result.append((document.get('href'), td.text_content() if td is not None else ''))
+    return result
+
+
+def get_info_table_link(page):
+    # link of the html rendering of the information table in a 13F filing index, '' if there is none
+    root = parse_html(page, FILE_TABLE)
+    if root is None:
+        return ''
+    for td in root.xpath('//td[normalize-space()="INFORMATION TABLE"]'):
+        document = td.getprevious()
+        if document is not None and document.text_content()[-4:] == 'html':
+            return get_href(document) or ''
+    return ''
+
+
+def get_info_value(page, label):
+    # text of the info div following the infoHead label on a filing index page, '' if there is none
+    i = page.find('>%s<' % label)
+    start = page.find('class="info"', i) if i >= 0 else -1
+    if start < 0:
+        return ''
+    start = page.find('>', start) + 1
+    end = page.find('<', start)
+    return page[start:end].strip() if end >= 0 else ''
+
+
+def get_filing_info(page):
+    # (form type, period of report) of a filing index page, e.g. ('13F-HR/A', '2023-12-31'); '' if missing
+    form_type = ''
+    i = page.find(FORM_NAME)
+    start = page.find('<strong>', i) if i >= 0 else -1
+    end = page.find('</strong>', start) if start >= 0 else -1
+    if end >= 0:
+        form_type = page[start + len('<strong>'):end].strip()
+        if form_type.startswith('Form '):
+            form_type = form_type[len('Form '):]
+    return form_type, get_info_value(page, PERIOD_HEAD)
+
+
+def get_info_table_rows(content):
+    # holdings rows of a rendered 13F information table, given as bytes, as tuples of the 12 column
+    # texts; the document is parsed incrementally straight from the bytes and each row is dropped
+    # from the tree once read
+    if not content or not content.strip():
+        return
+    rows = lxml.etree.iterparse(io.BytesIO(content), events=('end',), tag='tr', html=True, encoding='utf-8')
+    for _, tr in rows:
+        table = tr.getparent()
+        if table is not None and table.tag == 'tbody':
+            table = table.getparent()
+        if table is not None and table.get('summary') == INFO_TABLE:
+            tds = tr.findall('td')
+            if any('FormData' in (td.get('class') or '').split() for td in tds):
+                yield tuple(''.join(td.itertext()) for td in tds)
+        tr.clear()
+        parent = tr.getparent()
+        while tr.getprevious() is not None:
+            del parent[0]
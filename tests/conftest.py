@@ -0,0 +1,24 @@
+import os
+import sys
+import types
+
+# the SEC_*.py modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class NoDatabase:
+    # stands in for MongoDB.client.DevDB, which the scrapers import at load time: the tests never use
+    # the database, and a call reaching it fails the test instead of writing to the dev database
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            raise AssertionError('tests do not use the database, DevDB.%s was called' % name)
+        return call
+
+
+client = types.ModuleType('MongoDB.client')
+client.DevDB = NoDatabase()
+package = types.ModuleType('MongoDB')
+package.client = client
+sys.modules['MongoDB'] = package
+sys.modules['MongoDB.client'] = client
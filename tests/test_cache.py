@@ -0,0 +1,51 @@
+# On-disk http cache, see SEC_cache.py:
+#   python -m pytest tests
+
+import pytest
+import requests
+
+import SEC_cache
+import SEC_fetcher
+
+OWNER_URL = 'https://www.sec.gov/cgi-bin/own-disp?action=getowner&CIK=1000180'
+FILING_URL = 'https://www.sec.gov/Archives/edgar/data/1000180/000100018024000003/form4.xml'
+
+
+def response(url, headers):
+    r = requests.Response()
+    r.status_code = 200
+    r.url = url
+    r.encoding = 'utf-8'
+    r.headers.update(headers)
+    r._content = b'<html>page</html>'
+    return r
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    # fetches answered by the headers the test asks for, through a cache under tmp_path
+    cache = SEC_cache.PageCache(str(tmp_path))
+    monkeypatch.setattr(SEC_fetcher, 'CACHE', cache)
+    monkeypatch.setattr(SEC_fetcher, 'USER_AGENT', 'test')
+    monkeypatch.setattr(SEC_fetcher.LIMITER, 'acquire', lambda: None)
+    return cache
+
+
+def fetch(monkeypatch, url, headers):
+    monkeypatch.setattr(SEC_fetcher.SESSION, 'get', lambda url, **kwargs: response(url, headers))
+    return SEC_fetcher.fetch_response(url)
+
+
+def test_ttl_zero_page_without_validators_not_stored(cache, monkeypatch):
+    # a page revalidated on every fetch is only written to disk if it can be revalidated
+    assert fetch(monkeypatch, OWNER_URL, {}).status_code == 200
+    assert cache.get(OWNER_URL) is None
+    fetch(monkeypatch, OWNER_URL, {'ETag': '"abc"'})
+    assert cache.headers(cache.get(OWNER_URL)) == {'If-None-Match': '"abc"'}
+
+
+def test_filed_document_stored(cache, monkeypatch):
+    # filed documents are kept for good, validators or not
+    fetch(monkeypatch, FILING_URL, {})
+    meta = cache.get(FILING_URL)
+    assert cache.fresh(meta) and cache.response(meta).content == b'<html>page</html>'
@@ -0,0 +1,73 @@
+# Insider net money flow aggregates, see SEC_flow.py:
+#   python -m pytest tests
+
+import pandas as pd
+import pytest
+
+import SEC_flow
+
+
+def trade(symbol, cik, buy_sell, shares, price, date, relationship='Director', kind=None):
+    # one MA_SEC_Form4 row
+    kind = kind or ('S-Sale' if buy_sell == 'S' else 'P-Purchase')
+    return {'Symbol': symbol, 'ReporterCIK': cik, 'Buy/Sell': buy_sell, 'TransactionType': kind,
+            'TransactedAmt': shares, 'Price': price, 'Relationship': relationship, 'TransactionDate': date}
+
+
+ROWS = [trade('AAA', 1, 'B', 100, 10.0, '2024-01-01', 'Officer, Director'), # Monday
+        trade('AAA', 2, 'S', 50, 12.0, '2024-01-01', 'Director'),
+        trade('AAA', 3, 'B', 10, 10.0, '2024-01-03', '10 percent owner'),
+        trade('AAA', 1, 'B', 20, 10.0, '2024-01-09', 'Officer'), # next week
+        trade('BBB', 4, 'S', 5, 100.0, '2024-01-02', 'Officer'),
+        trade('BBB', 4, 'A', 1000, 0.0, '2024-01-02', 'Officer', kind='A-Award'), # moves no money
+        trade('', 5, 'B', 1, 1.0, '2024-01-02'), # no symbol
+        trade('BBB', 6, 'B', 1, 1.0, 'not a date')]
+
+
+def get_flows():
+    return SEC_flow.get_flows(SEC_flow.to_frame(ROWS))
+
+
+def test_get_flows():
+    # open market trades only, sales negative, weighted by the most senior role
+    flows = get_flows()
+    assert len(flows) == 5
+    first = flows.iloc[0]
+    assert (first['NetFlow'], first['WeightedFlow'], first['BuyValue'], first['Buys']) == (1000.0, 2000.0, 1000.0, 1)
+    assert first['OfficerCIK'] == 1 and first['DirectorCIK'] == 1
+    sale = flows.iloc[1]
+    assert (sale['NetFlow'], sale['WeightedFlow'], sale['SellValue'], sale['SellShares'], sale['Sells']) == \
+        (-600.0, -900.0, 600.0, 50.0, 1)
+    assert pd.isna(sale['OfficerCIK'])
+    assert flows.iloc[2]['WeightedFlow'] == 100.0
+
+
+def test_aggregate_daily():
+    daily = SEC_flow.aggregate(get_flows(), 'D')
+    assert list(daily.index) == [('AAA', pd.Timestamp('2024-01-01')), ('AAA', pd.Timestamp('2024-01-03')),
+                                 ('AAA', pd.Timestamp('2024-01-09')), ('BBB', pd.Timestamp('2024-01-02'))]
+    day = daily.loc[('AAA', pd.Timestamp('2024-01-01'))]
+    assert (day['NetFlow'], day['BuyValue'], day['SellValue'], day['Buys'], day['Sells']) == (400.0, 1000.0, 600.0, 1, 1)
+    assert (day['Insiders'], day['Officers'], day['Directors']) == (2, 1, 2)
+
+
+def test_aggregate_weekly():
+    # weeks start on Monday and count each insider once
+    weekly = SEC_flow.aggregate(get_flows(), 'W')
+    assert list(weekly.index) == [('AAA', pd.Timestamp('2024-01-01')), ('AAA', pd.Timestamp('2024-01-08')),
+                                  ('BBB', pd.Timestamp('2024-01-01'))]
+    week = weekly.loc[('AAA', pd.Timestamp('2024-01-01'))]
+    assert (week['NetFlow'], week['BuyShares'], week['Insiders']) == (500.0, 110.0, 3)
+    assert weekly.loc[('BBB', pd.Timestamp('2024-01-01')), 'NetFlow'] == -500.0
+
+
+def test_get_rolling():
+    # trailing sums over calendar days, so a day outside the window drops out even without rows between
+    daily = SEC_flow.aggregate(get_flows(), 'D')
+    rolling = SEC_flow.get_rolling(daily, days=7)
+    aaa = rolling.loc['AAA', 'RollingNetFlow']
+    assert aaa.to_dict() == {pd.Timestamp('2024-01-01'): 400.0, pd.Timestamp('2024-01-03'): 500.0,
+                             pd.Timestamp('2024-01-09'): 300.0}
+    assert rolling.loc[('BBB', pd.Timestamp('2024-01-02')), 'RollingSells'] == 1
+    assert SEC_flow.get_rolling(daily, days=30).loc[('AAA', pd.Timestamp('2024-01-09')), 'RollingNetFlow'] == \
+        pytest.approx(700.0)
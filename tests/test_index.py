@@ -0,0 +1,40 @@
+# Reading EDGAR index files for the backfills, see SEC_index.py:
+#   python -m pytest tests
+
+import SEC_index
+
+MASTER = '''Description:           Master Index of EDGAR Dissemination Feed
+Last Data Received:    April 2, 2024
+
+CIK|Company Name|Form Type|Date Filed|File Name
+--------------------------------------------------------------------------------
+1000045|Example Issuer Inc|4|20240402|edgar/data/1000045/0001000180-24-000003.txt
+1000180|Doe Jane|4|20240402|edgar/data/1000180/0001000180-24-000003.txt
+1000099|EXAMPLE CAPITAL MANAGEMENT LLC|13F-HR|20240402|edgar/data/1000099/0001000099-24-000002.txt
+'''
+
+
+def test_read_index(tmp_path):
+    # one filing per accession, of the requested forms, with dashed dates
+    path = tmp_path / 'master.20240402.idx'
+    path.write_text(MASTER, encoding='latin-1')
+    filings = list(SEC_index.read_index([str(path)], SEC_index.FORMS_4))
+    assert filings == [{'CIK': 1000045, 'CompanyName': 'Example Issuer Inc', 'FormType': '4',
+                        'DateFiled': '2024-04-02', 'FileName': 'edgar/data/1000045/0001000180-24-000003.txt'}]
+    assert SEC_index.get_index_link(filings[0]) == \
+        '/Archives/edgar/data/1000045/000100018024000003/0001000180-24-000003-index.htm'
+
+
+def test_read_index_skips_unreadable_source(tmp_path):
+    # a missing index is logged and the sources after it are still read
+    path = tmp_path / 'master.20240402.idx'
+    path.write_text(MASTER, encoding='latin-1')
+    sources = [str(tmp_path / 'master.20240406.idx'), str(path)]
+    assert [filing['CIK'] for filing in SEC_index.read_index(sources, SEC_index.FORMS_13F)] == [1000099]
+
+
+def test_get_source():
+    assert SEC_index.get_source('2024Q1') == 'https://www.sec.gov/Archives/edgar/full-index/2024/QTR1/master.idx'
+    assert SEC_index.get_source('20240402') == \
+        'https://www.sec.gov/Archives/edgar/daily-index/2024/QTR2/master.20240402.idx'
+    assert SEC_index.get_source('form.idx.gz') == 'form.idx.gz'
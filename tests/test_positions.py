@@ -0,0 +1,106 @@
+# Quarter-over-quarter 13F position changes, see SEC_positions.py:
+#   python -m pytest tests
+
+import pandas as pd
+
+import SEC_positions
+
+FIELDS = ('CIK', 'FiledDate', 'Period', 'FormType', 'CUSIP', 'Name', 'AMTType', 'Value', 'Amount', 'FormURL')
+
+
+def filing(cik, accession, filed, period, holdings, form='13F-HR'):
+    # holdings rows of one 13F filing, as stored in MA_SEC_13F; holdings maps CUSIP -> shares
+    url = '/Archives/edgar/data/%d/%s/infotable.xml' % (cik, accession)
+    return [dict(zip(FIELDS, (cik, filed, period, form, cusip, 'NAME ' + cusip, 'SH', shares * 10, shares, url)))
+            for cusip, shares in holdings.items()]
+
+
+def get_changes(rows):
+    # change of every position, keyed by (CIK, 'YYYY-MM-DD' period, CUSIP)
+    changes = SEC_positions.get_changes(SEC_positions.get_positions(SEC_positions.to_frame(rows)))
+    changes['Period'] = changes['Period'].dt.strftime('%Y-%m-%d')
+    return {(cik, period, cusip): (change, shares, prev_shares) for cik, period, cusip, change, shares, prev_shares
+            in zip(changes['CIK'], changes['Period'], changes['CUSIP'], changes['Change'],
+                   changes['Shares'], changes['PrevShares'])}
+
+
+HISTORY = (filing(1, 'a1', '2023-02-10', '2022-12-31', {'A': 100, 'B': 50, 'C': 20}) +
+           filing(1, 'a2', '2023-05-10', '2023-03-31', {'A': 150, 'B': 50, 'C': 10, 'D': 5}) +
+           filing(1, 'a3', '2023-08-10', '2023-06-30', {'A': 150, 'D': 5}) +
+           filing(2, 'b1', '2023-02-12', '2022-12-31', {'A': 10}) +
+           filing(2, 'b2', '2023-11-12', '2023-09-30', {'A': 30}))
+
+
+def test_get_changes():
+    # each period against the institution's previous one; the first period has nothing to compare with
+    changes = get_changes(HISTORY)
+    assert changes[(1, '2023-03-31', 'A')] == ('increased', 150, 100)
+    assert changes[(1, '2023-03-31', 'B')] == ('unchanged', 50, 50)
+    assert changes[(1, '2023-03-31', 'C')] == ('decreased', 10, 20)
+    assert changes[(1, '2023-03-31', 'D')] == ('new', 5, 0)
+    assert changes[(1, '2023-06-30', 'B')] == ('exited', 0, 50)
+    assert changes[(1, '2023-06-30', 'C')] == ('exited', 0, 10)
+    assert not any(period == '2022-12-31' for cik, period, cusip in changes)
+
+
+def test_get_changes_across_gap():
+    # an institution that skipped quarters is compared with its last reported period
+    changes = get_changes(HISTORY)
+    assert changes[(2, '2023-09-30', 'A')] == ('increased', 30, 10)
+    assert [key for key in changes if key[0] == 2] == [(2, '2023-09-30', 'A')]
+
+
+def test_get_positions_amendment():
+    # a 13F-HR/A supersedes the positions it reports and keeps the others of the base filing
+    rows = HISTORY + filing(1, 'a4', '2023-09-01', '2023-03-31', {'A': 175, 'E': 1}, form='13F-HR/A')
+    positions = SEC_positions.get_positions(SEC_positions.to_frame(rows)).loc[(1, pd.Timestamp('2023-03-31'))]
+    assert positions['Shares'].to_dict() == {('A', 'SH'): 175, ('B', 'SH'): 50, ('C', 'SH'): 10,
+                                             ('D', 'SH'): 5, ('E', 'SH'): 1}
+    changes = get_changes(rows)
+    assert changes[(1, '2023-03-31', 'A')] == ('increased', 175, 100)
+    assert changes[(1, '2023-06-30', 'A')] == ('decreased', 150, 175)
+    assert changes[(1, '2023-06-30', 'E')] == ('exited', 0, 1)
+
+
+def test_get_positions_restatement():
+    # a later 13F-HR for the same period replaces the earlier one as a whole
+    rows = HISTORY + filing(1, 'a5', '2023-09-02', '2023-03-31', {'A': 1})
+    positions = SEC_positions.get_positions(SEC_positions.to_frame(rows)).loc[(1, pd.Timestamp('2023-03-31'))]
+    assert positions['Shares'].to_dict() == {('A', 'SH'): 1}
+
+
+def test_get_positions_without_period():
+    # rows stored before the period was recorded fall back on the quarter before their filed date
+    rows = filing(3, 'c1', '2023-02-10', None, {'A': 1}, form=None)
+    positions = SEC_positions.get_positions(SEC_positions.to_frame(rows))
+    assert list(positions.index) == [(3, pd.Timestamp('2022-12-31'), 'A', 'SH')]
+
+
+def test_get_positions_empty():
+    # no rows still gives a frame the later steps can work with
+    positions = SEC_positions.get_positions(SEC_positions.to_frame([]))
+    assert positions.empty and list(positions.index.names) == SEC_positions.KEY
+    assert SEC_positions.get_changes(positions).empty
+
+
+def test_incremental_matches_rebuild():
+    # the changes of the rewritten pairs, computed from only the rows read for the touched pairs, are
+    # the same as those of a rebuild from every row, as update relies on
+    new = (filing(1, 'a4', '2023-09-01', '2023-03-31', {'A': 175, 'E': 1}, form='13F-HR/A') +
+           filing(2, 'b3', '2023-12-01', '2023-06-30', {'A': 20, 'F': 3}))
+    later = (filing(1, 'a6', '2023-11-10', '2023-09-30', {'A': 160}) +
+             filing(2, 'b4', '2024-02-12', '2023-12-31', {'A': 40}))
+    rows = SEC_positions.to_frame(HISTORY + new + later)
+    filings = rows[['CIK', 'FormURL']].assign(Period=SEC_positions.get_report_period(rows).dt.strftime('%Y-%m-%d'))
+    touched = {(1, '2023-03-31'), (2, '2023-06-30')}
+    read, rewrite = SEC_positions.get_neighbours(filings, touched)
+    assert rewrite == touched | {(1, '2023-06-30'), (2, '2023-09-30')}
+    assert read == rewrite | {(1, '2022-12-31'), (2, '2022-12-31')}
+    urls = set(filings.loc[pd.MultiIndex.from_frame(filings[['CIK', 'Period']]).isin(list(read)), 'FormURL'])
+    assert not urls & {row['FormURL'] for row in later}
+    incremental = get_changes(rows[rows['FormURL'].isin(urls)].to_dict('records'))
+    rebuild = get_changes(HISTORY + new + later)
+    assert {key: value for key, value in incremental.items() if key[:2] in rewrite} == \
+        {key: value for key, value in rebuild.items() if key[:2] in rewrite}
+    assert rebuild[(2, '2023-09-30', 'A')] == ('increased', 30, 20)
+    assert rebuild[(2, '2023-09-30', 'F')] == ('exited', 0, 3)
@@ -0,0 +1,125 @@
+# Replays the captured pages in tests/corpus (see SEC_replay.py) through the Form 4 and 13F parsers and
+# checks the records they produce; no network, browser or database is used (conftest.py stands in
+# for MongoDB.client):
+#   python -m pytest tests
+
+import os
+
+import pytest
+
+import SEC_fetcher
+import SEC_insider
+import SEC_Institution
+import SEC_replay
+from SEC_form4 import get_form4
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+REPORTER_CIK = 1000180
+ISSUER_CIK = 1000045
+FORM4_URL = '/Archives/edgar/data/1000045/000100018024000003/0001000180-24-000003-index.htm'
+INDEX_13F_URL = '/Archives/edgar/data/1000099/000100009922000007/0001000099-22-000007-index.htm'
+TABLE_13F_URL = '/Archives/edgar/data/1000099/000100009922000007/xslForm13F_X01/infotable.xml'
+
+
+@pytest.fixture(autouse=True)
+def corpus():
+    yield SEC_replay.replay(CORPUS)
+    SEC_fetcher.REPLAY = None
+
+
+def without_update_time(records):
+    return [{name: value for name, value in record.items() if name != 'UpdateTime'} for record in records]
+
+
+def test_owner_entry():
+    # the newest Form 4 of the reporter, with the relationship from the issuer table
+    assert SEC_insider.get_owner_entry(REPORTER_CIK) == {
+        'ReporterCIK': REPORTER_CIK, 'IssuerCIK': ISSUER_CIK, 'IssuerName': 'EXAMPLE ISSUER INC',
+        'Relationship': 'officer: Chief Financial Officer', 'SecurityName': 'Common Stock',
+        'FormURL': FORM4_URL, 'Direct/Indirect': 'D', 'TableLine': 2}
+
+
+def test_owner_entry_missing_page():
+    # a reporter without an own-disp page in the corpus gets SEC's 404, which fails the work item
+    with pytest.raises(SEC_fetcher.FetchError):
+        SEC_insider.get_owner_entry(999)
+
+
+def test_form4():
+    form4 = get_form4(FORM4_URL)
+    assert (form4['Symbol'], form4['IssuerCIK'], form4['FiledDate']) == ('EXMP', ISSUER_CIK, '2024-03-07')
+    assert form4['Owners'] == [{'CIK': REPORTER_CIK, 'Name': 'Doe Jane',
+                                'Relationship': 'officer: Chief Financial Officer'}]
+    assert [(row['Line'], row['TransCode'], row['TransAmt'], row['Price'])
+            for row in form4['NonDerivative']] == [(1, 'M', 5000, 12.5), (2, 'S', 2500, 187.34), (3, 'A', 1200, 0)]
+    assert [(row['TransCode'], row['ExercisePrice'], row['ExpirationDate'], row['UnderlyingAmt'])
+            for row in form4['Derivative']] == [('M', 12.5, '2027-02-15', 5000)]
+
+
+def test_form4_document_from_listing(corpus, monkeypatch):
+    # the raw document is found through the folder listing, without guessing the usual names first
+    fetched = list()
+    response = corpus.response
+    monkeypatch.setattr(corpus, 'response', lambda url: fetched.append(url) or response(url))
+    assert get_form4(FORM4_URL) is not None
+    folder = SEC_insider.PREFIX + '/Archives/edgar/data/1000045/000100018024000003/'
+    assert fetched == [folder + 'index.json', folder + 'wf-form4_170983214.xml']
+
+
+def test_form4_records():
+    # Table I sales and awards become records; the option exercise (code M) is left out
+    entry = SEC_insider.get_owner_entry(REPORTER_CIK)
+    records = SEC_insider.get_form4_records(entry, {ISSUER_CIK: 'EXMP'})
+    shared = {'Symbol': 'EXMP', 'IssuerCIK': ISSUER_CIK, 'ReporterCIK': REPORTER_CIK, 'Direct/Indirect': 'D',
+              'SecurityName': 'Common Stock', 'Relationship': 'officer: Chief Financial Officer',
+              'FormURL': FORM4_URL, 'FiledDate': '2024-03-07'}
+    expected = [dict(shared, **{'Buy/Sell': 'S', 'TransactionDate': '2024-03-05', 'TransactionType': 'S-Sale',
+                                'TransactedAmt': 2500, 'OwnedAmt': 41320, 'LineNumber': 2, 'Price': 187.34}),
+                dict(shared, **{'Buy/Sell': 'P', 'TransactionDate': '2024-03-06', 'TransactionType': 'A-Award',
+                                'TransactedAmt': 1200, 'OwnedAmt': 42520, 'LineNumber': 3, 'Price': 0})]
+    for record in expected:
+        record['_id'] = {name: record[name] for name in ('Symbol', 'IssuerCIK', 'ReporterCIK', 'TransactionDate',
+                                                         'LineNumber', 'FiledDate')}
+    assert without_update_time(records) == expected
+
+
+def test_13F_records():
+    # every holding of the information table, values in dollars, with the form type and period of
+    # the filing index page
+    records = [record for chunk in SEC_Institution.get_13F_chunks(INDEX_13F_URL, '2022-11-10') for record in chunk]
+    shared = {'CIK': 1000099, 'FiledDate': '2022-11-10', 'FormURL': TABLE_13F_URL, 'FormType': '13F-HR',
+              'Period': '2022-09-30'}
+    expected = [dict(shared, CUSIP='037833100', Name='APPLE INC', Class='COM', Value=13821000.0, Amount=100000,
+                     AMTType='SH', InvestmentDiscretion='SOLE', Other='', VotingSole=100000, VotingShared=0,
+                     VotingNone=0),
+                dict(shared, CUSIP='594918104', Name='MICROSOFT CORP', Class='COM', Value=5823000.0, Amount=25000,
+                     AMTType='SH', InvestmentDiscretion='DFND', Other='1', VotingSole=20000, VotingShared=5000,
+                     VotingNone=0),
+                dict(shared, CUSIP='78462F103', Name='SPDR S&P 500 ETF TR', Class='TR UNIT', Value=3572000.0,
+                     Amount=10000, AMTType='SH PUT', InvestmentDiscretion='SOLE', Other='', VotingSole=10000,
+                     VotingShared=0, VotingNone=0)]
+    for record in expected:
+        record['_id'] = {name: record[name] for name in ('CIK', 'FiledDate', 'CUSIP', 'Class', 'Amount', 'AMTType')}
+    assert without_update_time(records) == expected
+
+
+def test_13F_chunks():
+    # the holdings reach the writer in chunks of at most chunk_size
+    chunks = list(SEC_Institution.get_13F_chunks(INDEX_13F_URL, '2022-11-10', chunk_size=2))
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+
+
+def test_13F_missing_filing():
+    # a filing index SEC answers with 404 fails the filing instead of yielding no holdings
+    with pytest.raises(SEC_fetcher.FetchError):
+        list(SEC_Institution.get_13F_chunks('/Archives/edgar/data/1000099/000100009922000009/'
+                                            '0001000099-22-000009-index.htm', '2022-11-14'))
+
+
+def test_13F_blocked_filing(tmp_path):
+    # a block page served over http and in the browser never reaches the parsers
+    blocked = SEC_replay.Corpus(str(tmp_path))
+    blocked.add(SEC_Institution.PREFIX + INDEX_13F_URL, b'<html><body>Request Rate Threshold Exceeded</body></html>')
+    SEC_fetcher.REPLAY = blocked
+    with pytest.raises(SEC_fetcher.FetchError):
+        list(SEC_Institution.get_13F_chunks(INDEX_13F_URL, '2022-11-10'))